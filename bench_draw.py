@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import io
+import sys
+import json
+import time
+import random
+import pstats
+import argparse
+import cProfile
+import contextlib
+
+from waveshare import mockgpio
+mockgpio.install()
+
+from waveshare.epaper import EPaper
+from waveshare.simulator import Simulator
+
+from lib.invoicedisplay import InvoiceDisplay
+from lib.selections import SELECTIONS
+
+# lengths of the made up invoices, the real ones are around 300 characters
+SYNTHETIC_LENGTHS = [200, 400, 800, 1200]
+BECH32 = "QPZRY9X8GF2TVDW0S3JN54KHCE6MUA7L"
+
+# functions that CPU time is attributed to, by file and function name
+PROFILED = {'qr':     [('qrdraw.py', '__init__'),
+                       ('qrdraw.py', 'iter_draw_params')],
+            'encode': [('epaper.py', 'encode'),
+                       ('epaper.py', 'encode_into')]}
+
+
+def synthetic_selections():
+    r = random.Random(0)
+    for length in SYNTHETIC_LENGTHS:
+        invoice = "LNBC" + "".join(r.choice(BECH32)
+                                   for _ in range(length - 4))
+        yield {'first_line':  "Synthetic %d" % length,
+               'second_line': "%d character invoice" % length,
+               'price':       float(length),
+               'invoice':     invoice}
+
+
+def profiled_seconds(profile, functions):
+    stats = pstats.Stats(profile).stats
+    total = 0.0
+    for (filename, line, name), (cc, nc, tt, ct, callers) in stats.items():
+        for suffix, function in functions:
+            if filename.endswith(suffix) and name == function:
+                total += ct
+    return total
+
+
+def bench_selection(display, simulator, name, selection):
+    commands = simulator.commands
+    bytes_received = simulator.bytes_received
+    modeled_time = simulator.modeled_time
+
+    # timed once plain and once under the profiler to attribute CPU time
+    with contextlib.redirect_stdout(io.StringIO()):
+        cpu_start = time.process_time()
+        wall_start = time.time()
+        display.draw_selection(selection)
+        cpu = time.process_time() - cpu_start
+        wall = time.time() - wall_start
+
+    result = {'name':            name,
+              'invoice_length':  len(selection['invoice']),
+              'commands':        simulator.commands - commands,
+              'bytes':           simulator.bytes_received - bytes_received,
+              'modeled_seconds': simulator.modeled_time - modeled_time,
+              'cpu_seconds':     cpu,
+              'wall_seconds':    wall}
+
+    profile = cProfile.Profile()
+    with contextlib.redirect_stdout(io.StringIO()):
+        profile.runcall(display.draw_selection, selection)
+    for key, functions in PROFILED.items():
+        result['profiled_%s_seconds' % key] = profiled_seconds(profile,
+                                                               functions)
+    return result
+
+
+def check_budgets(results, budgets):
+    '''
+    Budgets map a selection name, or "*" for all of them, to the most each
+    metric is allowed to be. Returns a list of what went over.
+    '''
+    failures = []
+    for result in results:
+        for key in ["*", result['name']]:
+            for metric, limit in budgets.get(key, {}).items():
+                if result[metric] > limit:
+                    failures.append("%s: %s is %s, budget %s" % (
+                        result['name'], metric, result[metric], limit))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="replay invoices through InvoiceDisplay against the "
+                    "simulator and report what each draw costs")
+    parser.add_argument("-o", "--output", help="write JSON results here")
+    parser.add_argument("-b", "--budget",
+                        help="JSON file of per selection budgets to enforce")
+    parser.add_argument("--no-synthetic", action="store_true",
+                        help="only the selections in lib/selections.py")
+    args = parser.parse_args()
+
+    simulator = Simulator(width=600, height=800)
+    simulator.attach_gpio(mockgpio)
+    simulator.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        display = InvoiceDisplay(EPaper(port=simulator.port))
+
+    selections = [(s['first_line'], s) for s in SELECTIONS]
+    if not args.no_synthetic:
+        selections += [(s['first_line'], s) for s in synthetic_selections()]
+
+    results = [bench_selection(display, simulator, name, selection)
+               for name, selection in selections]
+    simulator.stop()
+
+    report = json.dumps({'results': results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+    if args.budget:
+        with open(args.budget, "r") as f:
+            failures = check_budgets(results, json.load(f))
+        for failure in failures:
+            print(failure, file=sys.stderr)
+        if failures:
+            sys.exit(1)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import random
+import sys
+import timeit
+
+from waveshare import mockgpio
+mockgpio.install()
+
+from waveshare.epaper import FillRectangle
+from waveshare.epaper import DrawRectangle
+from waveshare.epaper import FillCircle
+from waveshare.epaper import FillTriangle
+from waveshare.epaper import Command
+from waveshare.epaper import Handshake
+from waveshare.epaper import SetBaudrate
+from waveshare.epaper import SetStorageMode
+from waveshare.epaper import SetCurrentDisplayRotation
+from waveshare.epaper import SetPallet
+from waveshare.epaper import SetEnFontSize
+from waveshare.epaper import DisplayText
+from waveshare.epaper import RefreshAndUpdate
+
+from waveshare import bulk
+
+# roughly the number of rectangles in a large QR code
+COUNT = 5000
+REPEAT = 5
+
+
+class NamedImage(DisplayText):
+    # lays out its own packet, which encode_into() must go by
+    def convert_bytes(self):
+        return super().convert_bytes().upper()
+
+
+class SummedRectangle(FillRectangle):
+    # checks its packet its own way, which encode_into() must go by too
+    def calculate_checksum(self, data):
+        return (sum(data) & 0xff).to_bytes(1, byteorder='big')
+
+
+# one of each kind of data a command can carry
+SAMPLES = [Handshake(), SetBaudrate(115200),
+           SetStorageMode(SetStorageMode.TF_MODE),
+           SetCurrentDisplayRotation(SetCurrentDisplayRotation.FLIP),
+           SetPallet(SetPallet.DARK_GRAY, SetPallet.WHITE),
+           SetEnFontSize(SetEnFontSize.SIXTYFOUR),
+           DisplayText(20, 100, "0.00042 BTC".encode("gb2312")),
+           FillCircle(300, 400, 250), FillTriangle(1, 2, 3, 4, 5, 6),
+           DrawRectangle(0, 0, 799, 599), NamedImage(0, 0, b'pic7.bmp'),
+           SummedRectangle(10, 20, 30, 40),
+           Command(), RefreshAndUpdate()]
+
+
+def random_columns(n_columns, count):
+    return [[random.randrange(0, 800) for _ in range(count)]
+            for _ in range(n_columns)]
+
+
+def encode_objects(command_class, columns):
+    return b''.join(command_class(*row).encode() for row in zip(*columns))
+
+
+def bench(command_class):
+    columns = random_columns(bulk.coordinate_count(command_class), COUNT)
+
+    expected = encode_objects(command_class, columns)
+    if bulk.encode(command_class, *columns) != expected:
+        sys.exit("%s: bulk encoding differs from Command.encode()" %
+                 command_class.__name__)
+
+    per_object = min(timeit.repeat(
+        lambda: encode_objects(command_class, columns), number=1,
+        repeat=REPEAT))
+    in_bulk = min(timeit.repeat(
+        lambda: bulk.encode(command_class, *columns), number=1,
+        repeat=REPEAT))
+    print("%-14s %d packets  per-object: %0.4f s  bulk: %0.4f s  "
+          "speedup: %0.1fx" % (command_class.__name__, COUNT, per_object,
+                               in_bulk, per_object / in_bulk))
+
+
+def encode_all(commands):
+    return b''.join(command.encode() for command in commands)
+
+
+def encode_all_into(commands, buffer):
+    offset = 0
+    for command in commands:
+        offset += command.encode_into(buffer, offset)
+    return offset
+
+
+def check_encode_into(commands):
+    buffer = bytearray(sum(c.calculate_length() for c in commands) + 7)
+    view = memoryview(buffer)
+    for command in commands:
+        expected = command.encode()
+        for target, offset in [(buffer, 0), (view, 7)]:
+            length = command.encode_into(target, offset)
+            if bytes(buffer[offset:offset + length]) != expected:
+                sys.exit("%s: encode_into() differs from encode()" %
+                         type(command).__name__)
+
+
+def bench_encode_into():
+    commands = [FillRectangle(*row) for row in zip(*random_columns(4, COUNT))]
+    check_encode_into(commands)
+    buffer = bytearray(sum(c.calculate_length() for c in commands))
+    encode_all_into(commands, buffer)
+    if bytes(buffer) != encode_all(commands):
+        sys.exit("encode_into() differs from encode() in a run of packets")
+    encoded = min(timeit.repeat(lambda: encode_all(commands), number=1,
+                                repeat=REPEAT))
+    into = min(timeit.repeat(lambda: encode_all_into(commands, buffer),
+                             number=1, repeat=REPEAT))
+    print("%-14s %d packets  encode: %0.4f s  encode_into: %0.4f s  "
+          "speedup: %0.1fx" % ("encode_into", COUNT, encoded, into,
+                               encoded / into))
+
+
+if __name__ == '__main__':
+    check_encode_into(SAMPLES)
+    bench_encode_into()
+    for command_class in [FillRectangle, DrawRectangle, FillCircle,
+                          FillTriangle]:
+        bench(command_class)
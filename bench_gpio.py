@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import io
+import time
+import random
+import contextlib
+
+from waveshare import mockgpio
+mockgpio.install()
+
+from waveshare.epaper import EPaper
+from waveshare.gpio import InputService
+from waveshare.gpio import MockBackend
+from waveshare.metrics import StatsSink
+from waveshare.simulator import Simulator
+from waveshare.simulator import LatencyModel
+
+from lib.invoicedisplay import InvoiceDisplay
+from lib.renderqueue import RenderQueue
+from lib.selections import SELECTIONS
+
+BUTTONS = [16, 15, 11, 12]
+PRESSES = 20
+# time between presses, some well inside a draw and some after it
+INTERVALS = (0.05, 2.0)
+BOUNCES = 3
+# long enough for the last draw to finish
+SETTLE = 3
+
+
+if __name__ == '__main__':
+    simulator = Simulator(latency=LatencyModel(refresh=0.5), realtime=True,
+                          width=600, height=800)
+    simulator.attach_gpio(mockgpio)
+    simulator.start()
+    metrics = StatsSink()
+    with contextlib.redirect_stdout(io.StringIO()):
+        display = InvoiceDisplay(EPaper(port=simulator.port),
+                                 metrics=metrics)
+    queue = RenderQueue(display).start()
+    mapping = dict(zip(BUTTONS, SELECTIONS))
+
+    backend = MockBackend()
+    inputs = InputService(backend, metrics=metrics).start()
+    pressed = []
+    for pin in BUTTONS:
+        inputs.add_button(pin, lambda pin: (pressed.append(pin),
+                                            queue.submit(mapping[pin])))
+
+    r = random.Random(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(PRESSES):
+            backend.press(r.choice(BUTTONS), bounces=BOUNCES)
+            time.sleep(r.uniform(*INTERVALS))
+        time.sleep(SETTLE)
+        inputs.stop()
+        queue.stop()
+    simulator.stop()
+
+    stats = inputs.stats()
+    print("%d presses, %d edges, %d bounced, %d handled" % (
+        PRESSES, stats['edges'], stats['bounced'], stats['handled']))
+    print("%d draws, %d cancelled for a newer press" % (
+        queue.stats()['drawn'], queue.stats()['cancelled']))
+    print(metrics.report())
+    if len(pressed) != PRESSES:
+        raise SystemExit("lost %d presses" % (PRESSES - len(pressed)))
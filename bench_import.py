@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import sys
+import json
+import argparse
+import subprocess
+
+# what a script starting up the display imports
+MODULES = ["waveshare.epaper", "waveshare.program", "waveshare.panels",
+           "lib.invoicedisplay", "lib.framecache"]
+# slow to import, and only to be imported once they are used
+DEFERRED = ["serial", "RPi", "qrcode", "PIL", "numpy"]
+# seconds each module may take to import, a Pi is several times slower than
+# a desktop so this is generous there
+DEFAULT_BUDGET = 0.05
+REPEAT = 5
+
+MEASURE = '''
+import sys, time, json
+start = time.perf_counter()
+import %s
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds':  seconds,
+                  'deferred': [m for m in %r if m in sys.modules]}))
+'''
+
+
+def measure(module):
+    '''
+    Import the module in a fresh interpreter, the best of a few times.
+    '''
+    results = []
+    for _ in range(REPEAT):
+        out = subprocess.run([sys.executable, "-c",
+                              MEASURE % (module, DEFERRED)],
+                             check=True, stdout=subprocess.PIPE).stdout
+        results.append(json.loads(out))
+    return {'module':   module,
+            'seconds':  min(r['seconds'] for r in results),
+            'deferred': results[0]['deferred']}
+
+
+def check_budgets(results, budgets):
+    '''
+    Budgets map a module name, or "*" for all of them, to the most seconds
+    importing it may take. Returns a list of what went over, and of what
+    imported something it should have left until it was used.
+    '''
+    failures = []
+    for result in results:
+        limit = budgets.get(result['module'], budgets.get("*"))
+        if result['seconds'] > limit:
+            failures.append("%s: took %0.4f seconds, budget %0.4f" % (
+                result['module'], result['seconds'], limit))
+        if result['deferred']:
+            failures.append("%s: imported %s" % (
+                result['module'], ", ".join(result['deferred'])))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="time importing the display stack in a fresh "
+                    "interpreter and check it stays within budget")
+    parser.add_argument("-b", "--budget",
+                        help="JSON file of per module budgets in seconds")
+    args = parser.parse_args()
+
+    budgets = {"*": DEFAULT_BUDGET}
+    if args.budget:
+        with open(args.budget, "r") as f:
+            budgets.update(json.load(f))
+
+    results = [measure(module) for module in MODULES]
+    for result in results:
+        print("%-20s %0.4f seconds  %s" % (
+            result['module'], result['seconds'],
+            "imported " + ", ".join(result['deferred'])
+            if result['deferred'] else ""))
+
+    failures = check_budgets(results, budgets)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import gc
+import random
+import timeit
+import tracemalloc
+
+from waveshare import mockgpio
+mockgpio.install()
+
+from waveshare.epaper import FillRectangle
+from waveshare.epaper import RefreshAndUpdate
+from waveshare.program import ProgramRecorder
+
+# roughly the number of rectangles in a large QR code
+COUNT = 5000
+REPEAT = 5
+
+
+def random_rows(count):
+    r = random.Random(0)
+    return [(r.randrange(0, 600), r.randrange(0, 800), r.randrange(0, 600),
+             r.randrange(0, 800)) for _ in range(count)]
+
+
+def build_commands(rows):
+    return [FillRectangle(*row) for row in rows]
+
+
+def build_program(rows):
+    recorder = ProgramRecorder()
+    for row in rows:
+        recorder.send(FillRectangle(*row))
+    return recorder.program()
+
+
+def build_refreshes(rows):
+    return [RefreshAndUpdate() for _ in rows]
+
+
+def held_bytes(build, rows):
+    '''
+    Bytes still allocated by what build(rows) returns.
+    '''
+    gc.collect()
+    tracemalloc.start()
+    result = build(rows)
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return held
+
+
+def bench(name, build, rows):
+    seconds = min(timeit.repeat(lambda: build(rows), number=1,
+                                repeat=REPEAT))
+    held = held_bytes(build, rows)
+    print("%-22s %d  build: %0.4f s  held: %7d bytes  %5.1f bytes each" %
+          (name, len(rows), seconds, held, held / len(rows)))
+
+
+if __name__ == '__main__':
+    rows = random_rows(COUNT)
+    bench("FillRectangle list", build_commands, rows)
+    bench("FillRectangle program", build_program, rows)
+    bench("RefreshAndUpdate list", build_refreshes, rows)
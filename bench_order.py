@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import io
+import sys
+import random
+import contextlib
+
+from waveshare import mockgpio
+mockgpio.install()
+
+from waveshare.epaper import EPaper
+from waveshare.epaper import ClearScreen
+from waveshare.epaper import RefreshAndUpdate
+from waveshare.epaper import SetPallet
+from waveshare.epaper import SetEnFontSize
+from waveshare.epaper import SetZhFontSize
+from waveshare.epaper import DisplayText
+from waveshare.epaper import DrawCircle
+from waveshare.epaper import FillCircle
+from waveshare.epaper import DrawRectangle
+from waveshare.epaper import FillRectangle
+from waveshare.epaper import DrawTriangle
+from waveshare.epaper import FillTriangle
+from waveshare.simulator import Simulator
+from waveshare.draworder import DrawOrder
+
+# scenes of this many draws, mixing colors and font sizes like test_basic.py
+SCENE_SIZES = [20, 100, 400]
+SEEDS = 5
+
+COLORS = [SetPallet.BLACK, SetPallet.DARK_GRAY, SetPallet.LIGHT_GRAY]
+SIZES = [SetEnFontSize.THIRTYTWO, SetEnFontSize.FOURTYEIGHT,
+         SetEnFontSize.SIXTYFOUR]
+STATE_COMMANDS = [SetPallet.COMMAND[0], SetEnFontSize.COMMAND[0],
+                  SetZhFontSize.COMMAND[0]]
+
+
+def scene(seed, size):
+    '''
+    A list of commands that sets the pallet, and the font size for text,
+    before every draw.
+    '''
+    r = random.Random(seed)
+    commands = [ClearScreen()]
+    for _ in range(size):
+        commands.append(SetPallet(r.choice(COLORS), SetPallet.WHITE))
+        x, y = r.randrange(0, 700), r.randrange(0, 500)
+        kind = r.randrange(4)
+        if kind == 0:
+            commands.append(SetEnFontSize(r.choice(SIZES)))
+            commands.append(DisplayText(x, y, b"Hello"))
+        elif kind == 1:
+            cls = r.choice([DrawRectangle, FillRectangle])
+            commands.append(cls(x, y, x + r.randrange(5, 80),
+                                y + r.randrange(5, 80)))
+        elif kind == 2:
+            cls = r.choice([DrawCircle, FillCircle])
+            commands.append(cls(x + 40, y + 40, r.randrange(5, 40)))
+        else:
+            cls = r.choice([DrawTriangle, FillTriangle])
+            commands.append(cls(x, y, x, y + r.randrange(5, 80),
+                                x + r.randrange(5, 80), y))
+    commands.append(RefreshAndUpdate())
+    return commands
+
+
+def draw(commands, ordered):
+    '''
+    Draws the commands on a fresh simulator, returning what ends up on its
+    screen and how many state commands it got.
+    '''
+    simulator = Simulator()
+    simulator.attach_gpio(mockgpio)
+    simulator.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        paper = EPaper(port=simulator.port)
+        target = DrawOrder(paper) if ordered else paper
+        with paper.frame():
+            for command in commands:
+                target.send(command)
+            if ordered:
+                target.flush()
+        paper.read_responses(timeout=10)
+    simulator.stop()
+    state = sum(simulator.command_counts.get(c, 0) for c in STATE_COMMANDS)
+    return bytes(simulator.screen.pixels), state, simulator.modeled_time
+
+
+if __name__ == '__main__':
+    failed = False
+    for size in SCENE_SIZES:
+        before = after = 0
+        modeled_before = modeled_after = 0.0
+        for seed in range(SEEDS):
+            commands = scene(seed, size)
+            screen, state, modeled = draw(commands, False)
+            ordered_screen, ordered_state, ordered_modeled = draw(commands,
+                                                                  True)
+            if screen != ordered_screen:
+                print("%d draws, seed %d: reordering changed the screen" %
+                      (size, seed), file=sys.stderr)
+                failed = True
+            before += state
+            after += ordered_state
+            modeled_before += modeled
+            modeled_after += ordered_modeled
+        print("%4d draws: %5d state commands before %5d after, "
+              "%0.3f modeled seconds before %0.3f after" % (
+                  size, before // SEEDS, after // SEEDS,
+                  modeled_before / SEEDS, modeled_after / SEEDS))
+    if failed:
+        sys.exit(1)
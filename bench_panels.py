@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import io
+import time
+import contextlib
+
+from waveshare import mockgpio
+mockgpio.install()
+
+from waveshare.panels import PanelManager
+from waveshare.simulator import Simulator
+from waveshare.simulator import LatencyModel
+
+from lib.framecache import compile_selection
+from lib.invoicedisplay import InvoiceDisplay
+from lib.selections import SELECTIONS
+
+PANEL_COUNTS = [1, 2, 4, 8]
+# a short refresh so that the time is mostly spent on the wire
+LATENCY = LatencyModel(refresh=0.1)
+
+
+def bench(count, programs):
+    simulators = []
+    for index in range(count):
+        simulator = Simulator(latency=LATENCY, realtime=True, width=600,
+                              height=800)
+        # each panel gets its own reset and wakeup pins
+        simulator.attach_gpio(mockgpio, reset=100 + index, wakeup=200 + index)
+        simulators.append(simulator.start())
+    specs = [(s.port, 100 + i, 200 + i) for i, s in enumerate(simulators)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        with PanelManager(specs) as panels:
+            for future in panels.submit_all(InvoiceDisplay):
+                future.result()
+            start = time.time()
+            for program in programs:
+                for future in panels.broadcast(program):
+                    future.result()
+            elapsed = time.time() - start
+    for simulator in simulators:
+        simulator.stop()
+    refreshes = sum(s.refreshes for s in simulators)
+    return elapsed, refreshes
+
+
+if __name__ == '__main__':
+    start = time.time()
+    programs = [compile_selection(s) for s in SELECTIONS]
+    print("encoded %d selections once in %0.2f seconds" % (
+        len(programs), time.time() - start))
+    for count in PANEL_COUNTS:
+        elapsed, refreshes = bench(count, programs)
+        print("%d panels: %d frames in %0.2f seconds, %0.1f frames/second" %
+              (count, refreshes, elapsed, refreshes / elapsed))
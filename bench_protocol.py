@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import sys
+import time
+
+from waveshare import mockgpio
+mockgpio.install()
+
+from waveshare import epaper
+from waveshare.epaper import serial
+from waveshare.epaper import Command
+from waveshare.epaper import FixedCommand
+from waveshare.epaper import SetFontSize
+from waveshare.simulator import Simulator
+
+# How long to listen for an answer that may never come.
+QUIET = 0.2
+
+# Bases that aren't sent themselves.
+ABSTRACT = {Command, FixedCommand, SetFontSize}
+
+# The arguments to send each command class with.  A class that isn't here
+# fails the check, so that new ones get added.
+ARGS = {'SetBaudrate':               (epaper.DEFAULT_BAUDRATE,),
+        'SetStorageMode':            (),
+        'SetCurrentDisplayRotation': (),
+        'SetPallet':                 (),
+        'SetEnFontSize':             (),
+        'SetZhFontSize':             (),
+        'DisplayText':               (20, 20, b'OK'),
+        'DisplayImage':              (0, 0, b'PIC7.BMP'),
+        'DrawCircle':                (300, 400, 50),
+        'FillCircle':                (300, 400, 50),
+        'DrawTriangle':              (1, 2, 3, 4, 5, 6),
+        'FillTriangle':              (1, 2, 3, 4, 5, 6),
+        'DrawRectangle':             (0, 0, 10, 10),
+        'FillRectangle':             (0, 0, 10, 10)}
+
+
+def command_classes():
+    found = []
+    pending = [Command]
+    while pending:
+        cls = pending.pop()
+        pending.extend(cls.__subclasses__())
+        if cls not in ABSTRACT and cls.__module__ == epaper.__name__:
+            found.append(cls)
+    return sorted(found, key=lambda cls: cls.COMMAND)
+
+
+def answer(port, command):
+    '''
+    Everything the simulator says back to the command.
+    '''
+    port.write(command.encode())
+    answered = b''
+    deadline = time.monotonic() + QUIET
+    while time.monotonic() < deadline:
+        answered += port.read(64)
+    return answered
+
+
+def fits(command_class, answered):
+    '''
+    Whether a driver expecting RESPONSE_BYTES would take the answer as the
+    whole of this command's response and nothing more.
+    '''
+    if not command_class.RESPONSE_BYTES:
+        return answered == b''
+    if command_class.RESPONSE_VALUE:
+        return (0 < len(answered) <= command_class.RESPONSE_BYTES and
+                answered.isdigit())
+    return answered == b'OK'
+
+
+if __name__ == '__main__':
+    simulator = Simulator().start()
+    port = serial.Serial(simulator.port, epaper.DEFAULT_BAUDRATE,
+                         timeout=QUIET / 4)
+    failures = 0
+    for command_class in command_classes():
+        name = command_class.__name__
+        if name not in ARGS and not issubclass(command_class, FixedCommand):
+            print("%-26s no arguments to send it with" % name)
+            failures += 1
+            continue
+        answered = answer(port, command_class(*ARGS.get(name, ())))
+        # a module that was put to sleep doesn't answer what comes next
+        simulator.sleeping = False
+        ok = fits(command_class, answered)
+        failures += not ok
+        print("%-26s 0x%02x  expects %d  answered %-10r %s" % (
+            name, command_class.COMMAND[0], command_class.RESPONSE_BYTES,
+            answered, "ok" if ok else "MISMATCH"))
+    port.close()
+    simulator.stop()
+    if failures:
+        sys.exit("%d command classes disagree with the simulator" % failures)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import io
+import time
+import threading
+import contextlib
+
+from waveshare import mockgpio
+mockgpio.install()
+
+from waveshare.epaper import EPaper
+from waveshare.epaper import DEFAULT_BAUDRATE
+from waveshare.metrics import StatsSink
+from waveshare.simulator import Simulator
+from waveshare.simulator import LatencyModel
+from waveshare.transport import WriteBehindTransport
+
+from lib.invoicedisplay import InvoiceDisplay
+from lib.selections import SELECTIONS
+
+# a short refresh so that the time is mostly spent on the wire
+LATENCY = LatencyModel(refresh=0.1)
+
+
+def throttle(port):
+    '''
+    Make writes to the port take as long as they would on a UART, which a
+    pseudo-terminal doesn't, and count how long each thread spends in them.
+    '''
+    write = port.write
+    blocked = {}
+
+    def throttled(data):
+        start = time.perf_counter()
+        time.sleep(len(data) * 10.0 / DEFAULT_BAUDRATE)
+        n = write(data)
+        name = threading.current_thread().name
+        blocked[name] = blocked.get(name, 0.0) + time.perf_counter() - start
+        return n
+
+    port.write = throttled
+    return blocked
+
+
+def bench(transport):
+    simulator = Simulator(latency=LATENCY, realtime=True, width=600,
+                          height=800)
+    simulator.attach_gpio(mockgpio)
+    simulator.start()
+    metrics = StatsSink()
+    with contextlib.redirect_stdout(io.StringIO()):
+        paper = EPaper(port=simulator.port, metrics=metrics,
+                       transport=transport)
+        blocked = throttle(paper.serial)
+        display = InvoiceDisplay(paper, metrics=metrics)
+        blocked.clear()
+        start = time.time()
+        for selection in SELECTIONS:
+            display.draw_selection(selection)
+        elapsed = time.time() - start
+        paper.close()
+    simulator.stop()
+    caller = blocked.get(threading.current_thread().name, 0.0)
+    return elapsed, caller, simulator.refreshes
+
+
+if __name__ == '__main__':
+    for name, transport in [("direct", None),
+                            ("write-behind", WriteBehindTransport())]:
+        elapsed, caller, refreshes = bench(transport)
+        print("%-12s %d frames in %0.2f seconds, %0.2f seconds of it with "
+              "the drawing thread in serial.write()" % (name, refreshes,
+                                                         elapsed, caller))
+        if transport:
+            stats = transport.stats()
+            print("%-12s ring max %d of %d bytes, %d stalls for %0.3f "
+                  "seconds, %d drains for %0.3f seconds" % (
+                      "", stats['max_occupancy'], stats['size'],
+                      stats['stalls'], stats['stall_seconds'],
+                      stats['drains'], stats['drain_seconds']))
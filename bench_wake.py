@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import io
+import time
+import contextlib
+
+from waveshare.epaper import EPaper
+from waveshare.gpio import MockBackend
+from waveshare.metrics import StatsSink
+from waveshare.simulator import Simulator
+from waveshare.simulator import LatencyModel
+
+# how long the simulated module takes to come up after a reset or wake up
+BOOT_TIMES = [0.0, 0.1, 0.5, 1.0]
+# (first poll, longest poll) for EPaper.wait_ready()
+POLLS = [(0.05, 0.2), (0.05, 0.8), (0.02, 0.2), (0.1, 1.6)]
+SLEEP_SETTLE = 0.1
+
+
+def bench(boot, poll, max_poll):
+    gpio = MockBackend()
+    simulator = Simulator(latency=LatencyModel(boot=boot), realtime=True)
+    simulator.attach_gpio(gpio)
+    simulator.start()
+    metrics = StatsSink()
+    with contextlib.redirect_stdout(io.StringIO()):
+        paper = EPaper(port=simulator.port, gpio=gpio, metrics=metrics)
+        paper.reset()
+        reset = paper.wait_ready(poll=poll, max_poll=max_poll)
+        paper.sleep()
+        paper.flush()
+        # it isn't answered, give it time to get there before waking
+        time.sleep(SLEEP_SETTLE)
+        paper.wake()
+        wake = paper.wait_ready(poll=poll, max_poll=max_poll)
+        paper.close()
+    simulator.stop()
+    timings = metrics.snapshot()['timings']
+    handshakes = metrics.snapshot()['commands']['Handshake']
+    return (reset, wake, handshakes, timings['epaper.reset_pulse']['max'],
+            timings['epaper.wake_pulse']['max'])
+
+
+if __name__ == '__main__':
+    print("boot   poll       reset->ready  wake->ready  handshakes  "
+          "reset pulse  wake pulse")
+    for boot in BOOT_TIMES:
+        for poll, max_poll in POLLS:
+            reset, wake, handshakes, reset_pulse, wake_pulse = bench(
+                boot, poll, max_poll)
+            print("%0.2fs  %0.2f-%0.2fs  %0.3fs        %0.3fs       %3d"
+                  "         %0.1fus       %0.1fus" % (
+                      boot, poll, max_poll, reset, wake, handshakes,
+                      reset_pulse * 1e6, wake_pulse * 1e6))
@@ -0,0 +1,83 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import os
+
+from waveshare.program import Program
+from waveshare.program import ProgramRecorder
+
+from lib.invoicedisplay import InvoiceDisplay
+
+DEFAULT_DIRECTORY = os.path.expanduser("~/.cache/waveshare-epaper/frames")
+
+
+def compile_selection(selection):
+    """
+    Returns a Program of the packets InvoiceDisplay sends to draw the
+    selection.
+    """
+    recorder = ProgramRecorder()
+    InvoiceDisplay(recorder, setup=False).send_selection(selection)
+    return recorder.program()
+
+
+class FrameCache(object):
+    """
+    Keeps the compiled packets for drawing selections in a directory, a file
+    per selection named by InvoiceDisplay.selection_key(), so that drawing a
+    selection again only has to stream the file.  Files are memory mapped
+    and kept open once they have been used.
+
+    A selection is compiled the first time it is asked for, or ahead of
+    time with compile().
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.programs = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".prog")
+
+    def compile(self, selection):
+        """
+        Compile the selection and save it, replacing what was there.
+        """
+        key = InvoiceDisplay.selection_key(selection)
+        compile_selection(selection).save(self.path(key))
+        self._forget(key)
+        return self._load(key)
+
+    def program(self, selection):
+        """
+        Returns the Program for drawing the selection, compiling it if it
+        isn't in the cache.
+        """
+        key = InvoiceDisplay.selection_key(selection)
+        if key in self.programs:
+            return self.programs[key]
+        try:
+            return self._load(key)
+        except (OSError, ValueError):
+            return self.compile(selection)
+
+    def _load(self, key):
+        program = Program.load(self.path(key))
+        self.programs[key] = program
+        return program
+
+    def _forget(self, key):
+        program = self.programs.pop(key, None)
+        if program:
+            program.close()
+
+    def close(self):
+        for key in list(self.programs):
+            self._forget(key)
@@ -3,11 +3,13 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 
-import time
+import json
+import hashlib
+from contextlib import nullcontext
 
-import RPi.GPIO as GPIO
+from concurrent.futures import CancelledError
 
-from waveshare.epaper import Handshake
+from waveshare.epaper import BOARD
 from waveshare.epaper import RefreshAndUpdate
 from waveshare.epaper import SetPallet
 from waveshare.epaper import FillRectangle
@@ -15,6 +17,7 @@ from waveshare.epaper import DisplayText
 from waveshare.epaper import SetCurrentDisplayRotation
 from waveshare.epaper import SetEnFontSize
 from waveshare.epaper import ClearScreen
+from waveshare.metrics import NULL_SINK
 
 from lib.qrdraw import QRDraw
 
@@ -23,121 +26,194 @@ class InvoiceDisplay(object):
     """
     Class for drawing soda invoices on the e-paper screen
     """
-    def __init__(self, paper, mode=GPIO.BOARD, refresh_cb=None):
+    # Bump this whenever a selection is drawn differently, so that programs
+    # compiled by a FrameCache for the old layout aren't replayed.
+    LAYOUT_VERSION = 1
+    ROTATION = SetCurrentDisplayRotation.FLIP
+    # x, y and size of the square the QR code is drawn in
+    QR_BOX = (0, 200, 600)
+
+    def __init__(self, paper, mode=BOARD, refresh_cb=None, metrics=None,
+                 frame_cache=None, setup=True, power=None):
+        """
+        paper is the EPaper to draw on. metrics is the sink from
+        waveshare.metrics that each stage's timing is reported to, the same
+        one as the paper's if None. A PrintSink gives the old console output.
+
+        With a lib.framecache.FrameCache or lib.prerender.Prerenderer as the
+        frame_cache, selections are drawn by replaying the packets compiled
+        for them, if the paper has send_program().
+        setup=False skips setting up the display, for when it isn't a real
+        one.
+
+        With a waveshare.power.PowerManager, draws keep the display awake,
+        and wait for it to finish waking only once the QR code is made.
+        """
         self.paper = paper
         self.mode = mode
         self.refresh_cb = refresh_cb
-        self._setup_display()
-
-    def _handshake(self):
-        print("handshake")
-        start_time = time.time()
-        self.paper.send(Handshake())
-        print("handshake: %0.2f seconds" % (time.time() - start_time))
+        self.metrics = metrics or getattr(paper, 'metrics', NULL_SINK)
+        self.frame_cache = frame_cache
+        self.power = power
+        self.cancel = None
+        # a Deferred that fires once a TwistedEPaper has been set up
+        self.ready = None
+        if setup:
+            self._setup_display()
+
+    @classmethod
+    def selection_key(cls, selection):
+        """
+        A key that changes whenever what draw_selection() would send for the
+        selection changes.
+        """
+        layout = [cls.LAYOUT_VERSION, cls.ROTATION.hex(), cls.QR_BOX,
+                  selection['first_line'], selection['second_line'],
+                  "%.03f" % selection['price'], selection['invoice']]
+        return hashlib.sha256(json.dumps(layout).encode("utf8")).hexdigest()
+
+    def _send(self, command):
+        # the draw can be given up on between any two commands
+        if self.cancel is not None and self.cancel.is_set():
+            raise CancelledError()
+        self.paper.send(command)
+
+    def _wait_awake(self):
+        if self.power and not self.power.wait_ready():
+            raise TimeoutError("display didn't wake up")
+
+    def _wait_ready(self):
+        # which reports how long it took as epaper.wait_ready, and is a
+        # Deferred with a TwistedEPaper
+        return self.paper.wait_ready()
 
     def _set_pallet_black(self):
         # This is darker and good for text, but there is some bleed into
         # adjacent pixels on the grid.
-        print("set pallet")
-        start_time = time.time()
-        self.paper.send(SetPallet(SetPallet.BLACK, SetPallet.WHITE))
-        print("set pallet: %0.2f seconds" % (time.time() - start_time))
+        with self.metrics.span("invoice.set_pallet"):
+            self._send(SetPallet(SetPallet.BLACK, SetPallet.WHITE))
 
     def _set_pallet_gray(self):
         # this is the most accurate for staying in the pixel grid
-        print("set pallet")
-        start_time = time.time()
-        self.paper.send(SetPallet(SetPallet.DARK_GRAY, SetPallet.WHITE))
-        print("set pallet: %0.2f seconds" % (time.time() - start_time))
+        with self.metrics.span("invoice.set_pallet"):
+            self._send(SetPallet(SetPallet.DARK_GRAY, SetPallet.WHITE))
 
     def _set_rotation(self):
-        print("set rotation")
-        start_time = time.time()
-        self.paper.send(
-            SetCurrentDisplayRotation(SetCurrentDisplayRotation.FLIP))
-        print("set rotation: %0.2f seconds" % (time.time() - start_time))
+        with self.metrics.span("invoice.set_rotation"):
+            self._send(SetCurrentDisplayRotation(self.ROTATION))
 
     def _set_font_size_small(self):
-        print("set font size")
-        start_time = time.time()
-        self.paper.send(SetEnFontSize(SetEnFontSize.THIRTYTWO))
-        print("set font size: %0.2f seconds" % (time.time() - start_time))
+        with self.metrics.span("invoice.set_font_size"):
+            self._send(SetEnFontSize(SetEnFontSize.THIRTYTWO))
 
     def _set_font_size_medium(self):
-        print("set font size")
-        start_time = time.time()
-        self.paper.send(SetEnFontSize(SetEnFontSize.FOURTYEIGHT))
-        print("set font size: %0.2f seconds" % (time.time() - start_time))
+        with self.metrics.span("invoice.set_font_size"):
+            self._send(SetEnFontSize(SetEnFontSize.FOURTYEIGHT))
 
     def _set_font_size_large(self):
-        print("set font size")
-        start_time = time.time()
-        self.paper.send(SetEnFontSize(SetEnFontSize.SIXTYFOUR))
-        print("set font size: %0.2f seconds" % (time.time() - start_time))
+        with self.metrics.span("invoice.set_font_size"):
+            self._send(SetEnFontSize(SetEnFontSize.SIXTYFOUR))
 
     def _setup_display(self):
-        start_time = time.time()
-        print("setup display")
-        self._handshake()
-        # give the display a chance to initialize
-        time.sleep(2)
+        power = self.power.hold() if self.power else nullcontext()
+        with power, self.metrics.span("invoice.setup"):
+            self._wait_awake()
+            ready = self._wait_ready()
+            if hasattr(ready, 'addCallback'):
+                # carry on from the reactor once the module answers
+                ready.addCallback(lambda _: self._set_up())
+                self.ready = ready
+                return
+            self._set_up()
+
+    def _set_up(self):
         # set up specific settings
         self._set_rotation()
         # make sure setup is acknowledged before proceeding into normal
         # operation
-        self.paper.read_responses(timeout=10)
-        print("finished setup in %0.2f seconds" % (time.time() - start_time))
+        return self.paper.read_responses(timeout=10)
 
     def _fill_rectangle(self, x1, y1, x2, y2):
-        self.paper.send(FillRectangle(x1, y1, x2, y2))
+        self._send(FillRectangle(x1, y1, x2, y2))
 
     def _draw_qr(self, qr_draw):
-        start_time = time.time()
-        read_count = 0
-        x_offset, y_offset, scale = qr_draw.place_inside_box(0, 200, 600)
-        for color, x1, y1, x2, y2 in qr_draw.iter_draw_params(x_offset,
-                                                              y_offset,
-                                                              scale):
-            if color == 0xff:
-                continue
-            else:
-                self._fill_rectangle(x1, y1, x2, y2)
-        print("draw qr: %0.2f seconds" % (time.time() - start_time))
+        with self.metrics.span("invoice.draw_qr"):
+            x_offset, y_offset, scale = qr_draw.place_inside_box(
+                *self.QR_BOX)
+            for color, x1, y1, x2, y2 in qr_draw.iter_draw_params(
+                    x_offset, y_offset, scale, mode=QRDraw.COVER):
+                if color == 0xff:
+                    continue
+                else:
+                    self._fill_rectangle(x1, y1, x2, y2)
 
     def _refresh(self):
         if self.refresh_cb:
             self.refresh_cb()
-        start_time = time.time()
-        self.paper.send(RefreshAndUpdate())
-        print("refresh update: %0.2f seconds" % (time.time() - start_time))
+        with self.metrics.span("invoice.refresh"):
+            self._send(RefreshAndUpdate())
 
     def _draw_label(self, line1, line2, price):
-        start_time = time.time()
-        self._set_font_size_large()
-        self.paper.send(DisplayText(20, 20, line1.encode("gb2312")))
-        self._set_font_size_small()
-        self.paper.send(DisplayText(20, 100, line2.encode("gb2312")))
-        self._set_font_size_medium()
-        self.paper.send(DisplayText(20, 140, price.encode("gb2312")))
-        print("label: %0.2f seconds" % (time.time() - start_time))
+        with self.metrics.span("invoice.label"):
+            self._set_font_size_large()
+            self._send(DisplayText(20, 20, line1.encode("gb2312")))
+            self._set_font_size_small()
+            self._send(DisplayText(20, 100, line2.encode("gb2312")))
+            self._set_font_size_medium()
+            self._send(DisplayText(20, 140, price.encode("gb2312")))
 
     def _clear_screen(self):
-        print("clearing screen")
-        self.paper.send(ClearScreen())
-
-    def draw_selection(self, selection):
-        qd = QRDraw(selection['invoice'])
+        with self.metrics.span("invoice.clear_screen"):
+            self._send(ClearScreen())
+
+    def send_selection(self, selection):
+        """
+        Send the commands that draw the selection, without waiting on the
+        responses.
+        """
+        with self.metrics.span("invoice.qr_encode"):
+            qd = QRDraw(selection['invoice'])
+        self._wait_awake()
         line1 = selection['first_line']
         line2 = selection['second_line']
         price = "%.03f satoshis" % selection['price']
-        start_time = time.time()
-        print("drawing: %s - %s" % (line1, line2))
-        self._clear_screen()
-        self._set_pallet_gray()
-        self._draw_qr(qd)
-        self._set_pallet_black()
-        self._draw_label(line1, line2, price)
-        self._refresh()
-        print("reading after: %0.2f seconds" % (time.time() - start_time))
-        self.paper.read_responses()
-        print("finished: %0.2f seconds" % (time.time() - start_time))
+        with self.metrics.span("invoice.send"):
+            with self.paper.frame():
+                self._clear_screen()
+                self._set_pallet_gray()
+                self._draw_qr(qd)
+                self._set_pallet_black()
+                self._draw_label(line1, line2, price)
+                self._refresh()
+
+    def _send_program(self, selection):
+        with self.metrics.span("invoice.frame_cache"):
+            program = self.frame_cache.program(selection)
+        self._wait_awake()
+        if self.refresh_cb:
+            self.refresh_cb()
+        with self.metrics.span("invoice.send"):
+            self.paper.send_program(program, cancel=self.cancel)
+
+    def draw_selection(self, selection, cancel=None):
+        """
+        Draw the selection and wait on the responses. If the cancel
+        threading.Event is set while it is being sent, the draw stops at the
+        next command and CancelledError is raised.
+        """
+        self.cancel = cancel
+        power = self.power.hold() if self.power else nullcontext()
+        try:
+            with power, self.metrics.span("invoice.draw_selection"):
+                print("drawing: %s - %s" % (selection['first_line'],
+                                            selection['second_line']))
+                if self.frame_cache and hasattr(self.paper, 'send_program'):
+                    self._send_program(selection)
+                else:
+                    self.send_selection(selection)
+                # with a TwistedEPaper this is a Deferred that fires once the
+                # responses are in, so pass it back to the caller
+                with self.metrics.span("invoice.read_responses"):
+                    return self.paper.read_responses()
+        finally:
+            self.cancel = None
@@ -0,0 +1,146 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import os
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from waveshare.program import Program
+
+from lib.invoicedisplay import InvoiceDisplay
+from lib.framecache import compile_selection
+
+# Most bytes of compiled programs to hold in memory, an invoice is ~16k.
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+# How much to lower the priority of the worker processes by, so that they
+# only get the CPU when drawing doesn't need it.
+WORKER_NICENESS = 10
+# Workers are started from a clean server process rather than forked from
+# this one, whose other threads may be holding locks when it forks.
+START_METHOD = "forkserver"
+
+
+def _start_worker():
+    os.nice(WORKER_NICENESS)
+
+
+def _compile(selection):
+    # runs in a worker, a Program can't be pickled but its parts can
+    program = compile_selection(selection)
+    return bytes(program.data), program.offsets
+
+
+class Prerenderer(object):
+    """
+    Compiles the programs for selections that are likely to be drawn next,
+    such as those mapped to buttons or an invoice that was just issued, in
+    a pool of low priority worker processes while the display is idle.
+
+    It can be given to InvoiceDisplay as its frame_cache.  A selection that
+    is ready is then drawn straight from memory, one that isn't is compiled
+    on the spot (or taken from the fallback FrameCache) rather than waiting
+    on the workers, so a draw never waits on pre-rendering.
+
+    The programs held are limited to max_bytes, the least recently used
+    ones are dropped to make room.
+
+    The workers import the main module afresh, so a script using this
+    needs the usual `if __name__ == '__main__':` guard.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, workers=1, fallback=None):
+        self.max_bytes = max_bytes
+        self.fallback = fallback
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=_start_worker,
+            mp_context=multiprocessing.get_context(START_METHOD))
+        self.lock = threading.Lock()
+        self.programs = OrderedDict()
+        self.size = 0
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def schedule(self, selection):
+        """
+        Start compiling the selection in the background, unless it is ready
+        or already on its way.
+        """
+        key = InvoiceDisplay.selection_key(selection)
+        with self.lock:
+            if key in self.programs or key in self.pending:
+                return
+            future = self.pool.submit(_compile, selection)
+            self.pending[key] = future
+        future.add_done_callback(lambda f: self._compiled(key, f))
+
+    def schedule_all(self, selections):
+        for selection in selections:
+            self.schedule(selection)
+
+    def _compiled(self, key, future):
+        with self.lock:
+            self.pending.pop(key, None)
+        if future.cancelled() or future.exception():
+            return
+        data, offsets = future.result()
+        self._add(key, Program(data, offsets))
+
+    def _add(self, key, program):
+        size = len(program.data) + (len(program.offsets) *
+                                    program.offsets.itemsize)
+        with self.lock:
+            if key in self.programs or size > self.max_bytes:
+                return
+            self.programs[key] = (program, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.programs.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def ready(self, selection):
+        with self.lock:
+            return InvoiceDisplay.selection_key(selection) in self.programs
+
+    def program(self, selection):
+        """
+        Returns the Program for drawing the selection, without waiting on
+        the workers.
+        """
+        key = InvoiceDisplay.selection_key(selection)
+        with self.lock:
+            if key in self.programs:
+                self.programs.move_to_end(key)
+                self.hits += 1
+                return self.programs[key][0]
+            self.misses += 1
+        if self.fallback:
+            return self.fallback.program(selection)
+        program = compile_selection(selection)
+        self._add(key, program)
+        return program
+
+    def stats(self):
+        with self.lock:
+            return {'programs':  len(self.programs),
+                    'bytes':     self.size,
+                    'pending':   len(self.pending),
+                    'hits':      self.hits,
+                    'misses':    self.misses,
+                    'evictions': self.evictions}
+
+    def close(self):
+        """
+        Stop the workers, dropping whatever they haven't started on.
+        """
+        self.pool.shutdown(wait=False, cancel_futures=True)
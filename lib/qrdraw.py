@@ -3,19 +3,28 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 
 import sys
-import qrcode
 
 class QRDraw(object):
     """
     Encodes a QR code and iterates rectangle drawing instructions for
     displaying it on a pixel grid.
     """
+    # Rectangle modes for iter_draw_params(). ROWS yields one rectangle per
+    # horizontal run of a row. COVER merges runs across rows into large
+    # rectangles, which takes far fewer draw commands to send to a display.
+    ROWS = "rows"
+    COVER = "cover"
+
     def __init__(self, content):
         # A large border the QR code might be a good idea depending on what is
         # surrounding the physical display. A 4 blocks is generally advisable
         # for QR codes to ensure it can be easily picked up by a scanner.
         border = 2
 
+        # imported here rather than up top, it takes longer than the rest
+        # of the display stack put together and replaying a cached frame
+        # doesn't need it
+        import qrcode
         qr = qrcode.QRCode(version=1,
                            error_correction=qrcode.constants.ERROR_CORRECT_M,
                            box_size=1, border=border)
@@ -45,6 +54,50 @@ class QRDraw(object):
             x_end = len(row)
             yield y, x_start, x_end, row[x_start:x_end]
 
+    def _grow_rect(self, x, y, color):
+        # Among the rectangles with their top-left corner at (x, y) that are
+        # made up of only one color, find the one with the largest area. The
+        # width that is reachable can only shrink on each row further down.
+        x_limit = self.width
+        best_x_end = x + 1
+        best_y_end = y + 1
+        best_area = 0
+        y_end = y
+        while y_end < self.height:
+            row = y_end * self.width
+            x_end = x
+            while x_end < x_limit and self.data[row + x_end] == color:
+                x_end += 1
+            if x_end == x:
+                break
+            x_limit = x_end
+            y_end += 1
+            area = (x_end - x) * (y_end - y)
+            if area > best_area:
+                best_area = area
+                best_x_end = x_end
+                best_y_end = y_end
+        return best_x_end, best_y_end
+
+    def iter_cover_rects(self):
+        """
+        Iterates (x_start, y_start, x_end, y_end, color) rectangles that
+        together cover every module of the code. Rectangles of the same color
+        may overlap each other since filling a module twice paints the same
+        result, which lets each one be grown as large as possible.
+        """
+        covered = bytearray(len(self.data))
+        for y in range(self.height):
+            for x in range(self.width):
+                if covered[y * self.width + x]:
+                    continue
+                color = self.data[y * self.width + x]
+                x_end, y_end = self._grow_rect(x, y, color)
+                for cy in range(y, y_end):
+                    row = cy * self.width
+                    covered[row + x:row + x_end] = b'\x01' * (x_end - x)
+                yield x, y, x_end, y_end, color
+
     def iter_string_rows(self):
         rows = {}
         for y, x_start, x_end, rect in self.iter_rects():
@@ -61,14 +114,27 @@ class QRDraw(object):
         for rects in rows.values():
             yield "".join(rect['str'] for rect in rects)
 
-    def iter_draw_params(self, x_offset, y_offset, scale):
-        for y, x_start, x_end, rect in self.iter_rects():
+    def iter_module_rects(self, mode=ROWS):
+        """
+        Iterates (x_start, y_start, x_end, y_end, color) rectangles in module
+        coordinates for the given mode. The end coordinates are exclusive.
+        """
+        if mode == QRDraw.COVER:
+            yield from self.iter_cover_rects()
+        elif mode == QRDraw.ROWS:
+            for y, x_start, x_end, rect in self.iter_rects():
+                yield x_start, y, x_end, y + 1, rect[0]
+        else:
+            sys.exit("unknown rectangle mode: %s" % mode)
+
+    def iter_draw_params(self, x_offset, y_offset, scale, mode=ROWS):
+        for x_start, y_start, x_end, y_end, color in self.iter_module_rects(
+                mode):
             x_start = x_start * scale
             x_end = (x_end * scale) - 1
-            y_start = (y * scale)
-            y_end = ((y + 1) * scale) - 1
-            color = rect[0]
-            #print("%s, y: %d xstart: %d xend: %d" % (rect, y, x_start, x_end))
+            y_start = (y_start * scale)
+            y_end = (y_end * scale) - 1
+            #print("y: %d xstart: %d xend: %d" % (y_start, x_start, x_end))
             y1 = y_start + y_offset
             y2 = y_end + y_offset
             x1 = x_start + x_offset
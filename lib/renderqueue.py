@@ -0,0 +1,150 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import time
+import threading
+from concurrent.futures import CancelledError
+
+from lib.invoicedisplay import InvoiceDisplay
+
+
+class RenderQueue(object):
+    """
+    Draws selections on an InvoiceDisplay from a thread of its own, so that
+    button presses never have to wait or be dropped while a draw is going.
+
+    Requests that come in while a draw is going are coalesced into the
+    newest one. A draw of a different selection is given up on at the next
+    command boundary, before its refresh, so a stale invoice is never
+    refreshed onto the screen. The next draw starts by clearing the screen,
+    so nothing of the abandoned one shows. If the newest request is for the
+    selection already being drawn, that draw carries on to its refresh,
+    which is cheaper than starting over.
+
+    A draw that fails is reported and counted, and the queue goes on to the
+    next request.
+
+    The display's metrics sink gets the render.depth gauge (requests
+    waiting, before coalescing), render.cancelled, render.coalesced and
+    render.failed counts, and the render.latest_frame timing. That timing
+    runs from the newest request to its refresh being sent and its
+    responses read.
+    """
+    def __init__(self, display, metrics=None):
+        self.display = display
+        self.metrics = metrics or display.metrics
+        self.condition = threading.Condition()
+        self.cancel = threading.Event()
+        # (selection, key) of the newest request not being drawn yet
+        self.latest = None
+        # (key, time) of the newest request, until it is on the screen
+        self.newest = None
+        self.drawing = None
+        self.depth = 0
+        self.requests = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.drawn = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Give up on any draw going and stop the thread.
+        """
+        with self.condition:
+            self.stopped = True
+            self.cancel.set()
+            self.condition.notify()
+        self.thread.join()
+
+    def submit(self, selection):
+        """
+        Ask for the selection to be drawn, in place of anything else that is
+        waiting or being drawn.
+        """
+        key = InvoiceDisplay.selection_key(selection)
+        with self.condition:
+            self.requests += 1
+            self.newest = (key, time.monotonic())
+            if self.latest is not None:
+                self.coalesced += 1
+                self.metrics.count("render.coalesced")
+            if key == self.drawing:
+                # what is being drawn is what is wanted after all
+                self.latest = None
+                self.cancel.clear()
+                self.depth = 0
+            else:
+                self.latest = (selection, key)
+                self.depth += 1
+                if self.drawing is not None:
+                    self.cancel.set()
+            self.metrics.gauge("render.depth", self.depth)
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {'depth':     self.depth,
+                    'requests':  self.requests,
+                    'coalesced': self.coalesced,
+                    'cancelled': self.cancelled,
+                    'failed':    self.failed,
+                    'drawn':     self.drawn}
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.latest is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                selection, key = self.latest
+                self.latest = None
+                self.depth = 0
+                self.drawing = key
+                self.cancel.clear()
+                self.metrics.gauge("render.depth", self.depth)
+            outcome = None
+            try:
+                self.display.draw_selection(selection, cancel=self.cancel)
+                outcome = 'finished'
+            except CancelledError:
+                outcome = 'cancelled'
+            except Exception as e:
+                print("couldn't draw %s: %s" % (selection['first_line'], e))
+                outcome = 'failed'
+            finally:
+                with self.condition:
+                    self.drawing = None
+                    self._done(outcome, selection, key)
+
+    def _done(self, outcome, selection, key):
+        # called with the condition held
+        if outcome == 'finished':
+            self._finished(key)
+        elif outcome == 'cancelled':
+            self.cancelled += 1
+            self.metrics.count("render.cancelled")
+            if self.latest is None and not self.stopped:
+                # asked to stop for a request that was taken back
+                self.latest = (selection, key)
+        elif outcome == 'failed':
+            self.failed += 1
+            self.metrics.count("render.failed")
+            if self.newest is not None and self.newest[0] == key:
+                # it won't be on the screen, so it can't be timed
+                self.newest = None
+
+    def _finished(self, key):
+        self.drawn += 1
+        if self.newest is not None and self.newest[0] == key:
+            self.metrics.timing("render.latest_frame",
+                                time.monotonic() - self.newest[1])
+            self.newest = None
@@ -6,6 +6,9 @@
 import RPi.GPIO as GPIO
 
 from waveshare.epaper import EPaper
+from waveshare.metrics import MultiSink
+from waveshare.metrics import PrintSink
+from waveshare.metrics import StatsSink
 
 from lib.invoicedisplay import InvoiceDisplay
 from lib.selections import SELECTIONS
@@ -14,7 +17,8 @@ import time
 
 
 if __name__ == '__main__':
-    with EPaper() as paper:
+    stats = StatsSink()
+    with EPaper(metrics=MultiSink(PrintSink(), stats)) as paper:
         display = InvoiceDisplay(paper)
         print("display is ready, starting in 2 seconds...")
         time.sleep(2)
@@ -28,4 +32,5 @@ if __name__ == '__main__':
         print("any remaining bytes to read from the device?")
         b = paper.read()
         print("%d bytes remaining" % len(b))
+        print(stats.report())
         print("done everything")
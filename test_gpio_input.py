@@ -6,12 +6,16 @@
 import RPi.GPIO as GPIO
 
 from waveshare.epaper import EPaper
+from waveshare.epaper import PORT_DEVICE
+from waveshare.gpio import InputService
+from waveshare.gpio import RPiGPIOBackend
+from waveshare.power import PowerManager
 
 from lib.invoicedisplay import InvoiceDisplay
+from lib.prerender import Prerenderer
+from lib.renderqueue import RenderQueue
 from lib.selections import SELECTIONS
 
-import time
-
 
 # the order of buttons to GPIO pin connection on my breadboard. YMMV
 BUTTON_1 = 16
@@ -27,40 +31,38 @@ MAPPING = {BUTTON_1: SELECTIONS[0],
 
 
 class ButtonDrive(object):
-    def __init__(self):
-        GPIO.setmode(GPIO.BOARD)
-        GPIO.setup(BUTTON_1, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(BUTTON_2, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(BUTTON_3, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(BUTTON_4, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        self.display = InvoiceDisplay(EPaper(), mode=None)
-        self.drawing = False
+    def __init__(self, port=PORT_DEVICE):
+        # presses are debounced and handed to button() on the main thread,
+        # which only queues up work so it never holds up the next press
+        self.inputs = InputService(RPiGPIOBackend(mode=GPIO.BOARD))
+        self.inputs.add_button(BUTTON_1, self.button)
+        self.inputs.add_button(BUTTON_2, self.button)
+        self.inputs.add_button(BUTTON_3, self.button)
+        self.inputs.add_button(BUTTON_4, self.button)
+        # compile the mapped selections while the display sets up
+        self.prerenderer = Prerenderer()
+        self.prerenderer.schedule_all(MAPPING.values())
+        paper = EPaper(port=port)
+        # put the display to sleep when it hasn't been used for a minute
+        self.power = PowerManager(paper, idle=60).start()
+        self.display = InvoiceDisplay(paper, mode=None,
+                                      frame_cache=self.prerenderer,
+                                      power=self.power)
+        # draws the latest press, giving up on a draw that is going
+        self.queue = RenderQueue(self.display).start()
 
     def button(self, button_no):
         print("pressed: %d" % button_no)
-        if self.drawing:
-            print("drawing, skipping")
-            return
-        print("start draw")
-        self.drawing = True
-        selection = MAPPING[button_no]
-        self.display.draw_selection(MAPPING[button_no])
-        self.drawing = False
-        print("draw finished")
+        # start waking the display before the draw needs it
+        self.power.wake()
+        self.queue.submit(MAPPING[button_no])
 
 
 if __name__ == '__main__':
     bd = ButtonDrive()
-    GPIO.add_event_detect(BUTTON_1, GPIO.FALLING, callback=bd.button,
-                          bouncetime=200)
-    GPIO.add_event_detect(BUTTON_2, GPIO.FALLING, callback=bd.button,
-                          bouncetime=200)
-    GPIO.add_event_detect(BUTTON_3, GPIO.FALLING, callback=bd.button,
-                          bouncetime=200)
-    GPIO.add_event_detect(BUTTON_4, GPIO.FALLING, callback=bd.button,
-                          bouncetime=200)
     print("start")
-    while True:
-        time.sleep(0.01)
-
-    GPIO.cleanup()
+    try:
+        bd.inputs.run()
+    finally:
+        print(bd.inputs.stats())
+        GPIO.cleanup()
@@ -5,7 +5,8 @@
 
 import RPi.GPIO as GPIO
 
-import time
+from waveshare.gpio import InputService
+from waveshare.gpio import RPiGPIOBackend
 
 
 # the order of buttons to GPIO pin connection on my breadboard. YMMV
@@ -33,11 +34,11 @@ STATE = {LED_1: None,
 
 class ButtonDrive(object):
     def __init__(self):
-        GPIO.setmode(GPIO.BOARD)
-        GPIO.setup(BUTTON_1, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(BUTTON_2, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(BUTTON_3, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(BUTTON_4, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        self.inputs = InputService(RPiGPIOBackend(mode=GPIO.BOARD))
+        self.inputs.add_button(BUTTON_1, self.button)
+        self.inputs.add_button(BUTTON_2, self.button)
+        self.inputs.add_button(BUTTON_3, self.button)
+        self.inputs.add_button(BUTTON_4, self.button)
 
         GPIO.setup(LED_1, GPIO.OUT)
         GPIO.setup(LED_2, GPIO.OUT)
@@ -69,16 +70,10 @@ class ButtonDrive(object):
 
 if __name__ == '__main__':
     bd = ButtonDrive()
-    GPIO.add_event_detect(BUTTON_1, GPIO.FALLING, callback=bd.button,
-                          bouncetime=150)
-    GPIO.add_event_detect(BUTTON_2, GPIO.FALLING, callback=bd.button,
-                          bouncetime=150)
-    GPIO.add_event_detect(BUTTON_3, GPIO.FALLING, callback=bd.button,
-                          bouncetime=150)
-    GPIO.add_event_detect(BUTTON_4, GPIO.FALLING, callback=bd.button,
-                          bouncetime=150)
     print("start")
-    while True:
-        time.sleep(0.01)
-
-    GPIO.cleanup()
+    try:
+        # calls bd.button for each press until interrupted
+        bd.inputs.run()
+    finally:
+        print(bd.inputs.stats())
+        GPIO.cleanup()
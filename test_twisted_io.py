@@ -6,10 +6,11 @@
 import time
 
 import RPi.GPIO as GPIO
-from twisted.internet import reactor, threads
+from twisted.internet import reactor
+from twisted.internet.defer import maybeDeferred
 from twisted.internet.task import LoopingCall
 
-from waveshare.epaper import EPaper
+from waveshare.twistedepaper import TwistedEPaper
 
 from lib.invoicedisplay import InvoiceDisplay
 from lib.selections import SELECTIONS
@@ -84,9 +85,10 @@ class ButtonEInkUI(object):
     def __init__(self):
         self.bd = ButtonDrive(self.button_event)
         self.leds_on()
-        paper = EPaper()
+        paper = TwistedEPaper()
         self.display = InvoiceDisplay(paper, refresh_cb=self.refresh_cb)
         self.drawing = False
+        self.next_button = None
         self.blink = None
         self.led_state = None
         self.leds_off()
@@ -102,8 +104,8 @@ class ButtonEInkUI(object):
                               bouncetime=150)
 
     def refresh_cb(self):
-        self.blink.stop()
-        self.leds_on()
+        # the draw is written out from the reactor after draw_selection()
+        # returns, so the LEDs keep blinking until finish_drawing()
         print("ok, refreshing")
 
     def leds_on(self):
@@ -128,30 +130,41 @@ class ButtonEInkUI(object):
 
     def button_event(self, button):
         if self.drawing:
-            print("already drawing, dropping on floor")
+            # draw the latest press next, and drop what hasn't been written
+            # of the draw going so it doesn't get refreshed onto the screen
+            print("already drawing, drawing this one next")
+            self.next_button = button
+            self.display.paper.cancel_queued()
             return
 
         print("got button: %s" % button)
         self.drawing = True
         self.leds_on()
         print("kicking off draw")
-        d = threads.deferToThread(self.display.draw_selection,
-                                  SELECTION_MAPPING[button])
-        d.addCallback(self.finish_drawing)
         self.blink = LoopingCall(self.leds_flip)
         self.blink.start(0.2, now=False)
+        d = maybeDeferred(self.display.draw_selection,
+                          SELECTION_MAPPING[button])
+        d.addCallback(self.finish_drawing)
 
     def finish_drawing(self, result):
+        self.blink.stop()
         self.drawing = False
         self.leds_off()
         print("finished_drawing")
+        if self.next_button is not None:
+            button = self.next_button
+            self.next_button = None
+            self.button_event(button)
     
 
 if __name__ == '__main__':
 
     bei = ButtonEInkUI()
 
-    reactor.callInThread(bei.button_thread)
+    # take button presses once the display is up
+    bei.display.ready.addCallback(
+        lambda _: reactor.callInThread(bei.button_thread))
     reactor.run()
     print("cleaning up")
     GPIO.cleanup()
@@ -0,0 +1,271 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import os
+import asyncio
+
+from waveshare.epaper import serial
+from waveshare.gpio import BOARD
+from waveshare.gpio import RPiGPIOBackend
+from waveshare.metrics import NULL_SINK
+from waveshare.epaper import PORT_DEVICE
+from waveshare.epaper import PIN_RESET
+from waveshare.epaper import PIN_WAKEUP
+from waveshare.epaper import DEFAULT_BAUDRATE
+from waveshare.epaper import RefreshAndUpdate
+from waveshare.epaper import SleepMode
+from waveshare.responses import ResponseParser
+from waveshare.flowcontrol import FlowWindow
+
+###############################################################################
+# asyncio EPaper object
+###############################################################################
+
+# Once this many bytes are waiting to be written, send() waits for them to go
+# out before returning.
+WRITE_HIGH_WATER = 4096
+READ_SIZE = 1024
+# How long the device has to be quiet before a response that could still be
+# growing (an error code or a value) is taken as complete.
+READ_IDLE = 0.05
+
+class AsyncEPaper(object):
+    '''
+    The same as EPaper, but for use from an asyncio event loop.  The serial
+    device is used as a non-blocking file descriptor watched by the loop, so
+    no thread is ever blocked on it.
+
+    It is used as an async context manager, which runs the reader coroutine
+    that resolves the response futures:
+
+        async with AsyncEPaper() as paper:
+            await paper.send(Handshake())
+            ok = await paper.send(ClearScreen())
+            await ok
+    '''
+    def __init__(self, port=PORT_DEVICE, reset=PIN_RESET, wakeup=PIN_WAKEUP,
+                 mode=BOARD, window=None, gpio=None, metrics=None):
+        '''
+        @param port The file name to open.
+        @param reset The GPIO pin to use for resets.
+        @param wakeup The GPIO pin to use for wakeups.
+        @param mode The mode of GPIO pin addressing (GPIO.BOARD is the
+                    default).
+        @param window The FlowWindow limiting how many commands are sent ahead
+                      of their responses (a default one if None).
+        @param gpio The waveshare.gpio backend for the reset and wakeup pins,
+                    an RPiGPIOBackend in mode if None.
+        @param metrics The sink from waveshare.metrics to report the reset
+                       and wakeup pulses to (nothing is kept if None).
+        '''
+        self.port = port
+        self.reset_pin = reset
+        self.wakeup_pin = wakeup
+
+        self.metrics = metrics or NULL_SINK
+        self.gpio = gpio or RPiGPIOBackend(mode)
+        self.gpio.setup_outputs([reset, wakeup])
+        try:
+            self.serial = serial.Serial(port)
+            self.serial.baudrate = DEFAULT_BAUDRATE
+            self.serial.bytesize = serial.EIGHTBITS
+            self.serial.parity = serial.PARITY_NONE
+        except Exception:
+            self.gpio.release([reset, wakeup])
+            raise
+        self.fd = self.serial.fileno()
+        os.set_blocking(self.fd, False)
+
+        self.responses = ResponseParser()
+        self.window = window or FlowWindow()
+        self.responses.add_listener(self._response_received)
+
+        self.loop = None
+        self.reader = None
+        self.readable = None
+        self.out = bytearray()
+        self.writing = False
+        self.drained = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        '''
+        Stops the reader and cleans up this object's GPIO pins.
+        '''
+        await self.close()
+
+    def start(self):
+        '''
+        Start the reader coroutine on the running event loop.
+        '''
+        if self.reader:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.readable = asyncio.Event()
+        self.reader = self.loop.create_task(self._read_forever())
+
+    async def close(self):
+        '''
+        Stop reading and writing and clean up this object's GPIO pins.
+        Commands still waiting on a response have their futures cancelled
+        and anything not yet written is dropped.
+        '''
+        if self.reader:
+            self.reader.cancel()
+            try:
+                await self.reader
+            except asyncio.CancelledError:
+                pass
+            self.reader = None
+        if self.writing:
+            self.loop.remove_writer(self.fd)
+            self.writing = False
+        self.out.clear()
+        if self.drained and not self.drained.done():
+            self.drained.cancel()
+        self.responses.cancel()
+        self.serial.close()
+        self.gpio.release([self.reset_pin, self.wakeup_pin])
+
+    def reset(self):
+        '''
+        Reset the display by setting the reset pin to high and then low.
+        '''
+        self._pulse(self.reset_pin, "epaper.reset_pulse")
+
+    async def sleep(self):
+        '''
+        Tell the display to go to sleep.
+        '''
+        return await self.send(SleepMode())
+
+    def wake(self):
+        '''
+        Tell the device to wake up.  It only makes sense to do this after
+        telling it to sleep.
+        '''
+        self._pulse(self.wakeup_pin, "epaper.wake_pulse")
+
+    def _pulse(self, pin, name):
+        seconds = self.gpio.pulse(pin)
+        if self.metrics.enabled:
+            self.metrics.timing(name, seconds)
+
+    async def update(self):
+        '''
+        Update the display.
+        '''
+        return await self.send(RefreshAndUpdate())
+
+    async def send(self, command):
+        '''
+        Send the provided command to the device.  This waits while the flow
+        control window is full or too much is still waiting to be written,
+        but not for the response.
+
+        Returns an asyncio.Future that resolves with the response to this
+        command, or fails with a ResponseError if the device reports an
+        error.
+        '''
+        if command.RESPONSE_BYTES:
+            while self.responses.in_flight >= self.window.limit():
+                oldest = self.responses.oldest()
+                if not oldest:
+                    break
+                done, _ = await asyncio.wait([oldest[1]],
+                                             timeout=self.window.timeout)
+                if not done:
+                    self.window.overrun()
+                    break
+        future = self.responses.expect(command, self.loop.create_future())
+        self._write(command.encode())
+        if len(self.out) >= WRITE_HIGH_WATER:
+            await self.drain()
+        return future
+
+    async def drain(self):
+        '''
+        Wait for everything sent so far to be written to the device.
+        '''
+        if not self.out:
+            return
+        if not self.drained or self.drained.done():
+            self.drained = self.loop.create_future()
+        await asyncio.shield(self.drained)
+
+    async def read_responses(self, timeout=3):
+        '''
+        Wait for the responses to every command sent so far, for up to
+        timeout seconds.
+        '''
+        futures = self.responses.futures()
+        if futures:
+            await asyncio.wait(futures, timeout=timeout)
+
+    def _write(self, packet):
+        if not self.out:
+            try:
+                n = os.write(self.fd, packet)
+            except BlockingIOError:
+                n = 0
+            if n == len(packet):
+                self.responses.sent()
+                return
+            packet = packet[n:]
+        self.out.extend(packet)
+        if not self.writing:
+            self.loop.add_writer(self.fd, self._writable)
+            self.writing = True
+
+    def _writable(self):
+        try:
+            n = os.write(self.fd, self.out)
+        except BlockingIOError:
+            return
+        del self.out[:n]
+        if self.out:
+            return
+        self.loop.remove_writer(self.fd)
+        self.writing = False
+        self.responses.sent()
+        if self.drained and not self.drained.done():
+            self.drained.set_result(None)
+
+    async def _read_forever(self):
+        '''
+        The reader coroutine. Feeds whatever the device sends to the
+        response parser.
+        '''
+        self.loop.add_reader(self.fd, self.readable.set)
+        # asyncio.wait() rather than wait_for(), which can swallow the
+        # cancellation that stops this if it comes as the wait times out
+        waiter = None
+        try:
+            while True:
+                if waiter is None:
+                    waiter = self.loop.create_task(self.readable.wait())
+                done, _ = await asyncio.wait([waiter], timeout=READ_IDLE)
+                if not done:
+                    self.responses.idle()
+                    continue
+                waiter = None
+                self.readable.clear()
+                try:
+                    b = os.read(self.fd, READ_SIZE)
+                except BlockingIOError:
+                    continue
+                self.responses.feed(b)
+        finally:
+            if waiter:
+                waiter.cancel()
+            self.loop.remove_reader(self.fd)
+
+    def _response_received(self, command, kind, latency, in_flight):
+        if kind == 'error':
+            self.window.overrun()
+        elif latency is not None:
+            self.window.acked(latency, in_flight)
@@ -0,0 +1,92 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import numpy
+
+from waveshare.epaper import Command
+from waveshare.epaper import DrawCircle
+from waveshare.epaper import DrawRectangle
+from waveshare.epaper import DrawTriangle
+
+###############################################################################
+# Bulk packet encoding
+###############################################################################
+
+# The shape commands take a fixed number of 16 bit coordinates. The fill
+# variants are subclasses of these and take the same number.
+COORDINATE_COUNTS = {DrawCircle:    3,
+                     DrawRectangle: 4,
+                     DrawTriangle:  6}
+
+FRAME_HEADER = numpy.frombuffer(Command.FRAME_HEADER, dtype=numpy.uint8)
+FRAME_FOOTER = numpy.frombuffer(Command.FRAME_FOOTER, dtype=numpy.uint8)
+
+# What fits in a 16 bit coordinate.
+COORDINATE_MAX = 0xffff
+
+
+def coordinate_count(command_class):
+    '''
+    Returns the number of coordinates the shape command class takes.
+    '''
+    for cls in command_class.__mro__:
+        if cls in COORDINATE_COUNTS:
+            return COORDINATE_COUNTS[cls]
+    raise ValueError("%s can't be bulk encoded" % command_class.__name__)
+
+
+def packet_length(command_class):
+    '''
+    Returns the length of one encoded packet of the command class.
+    '''
+    return (Command.HEADER_LENGTH + Command.LENGTH_LENGTH +
+            Command.COMMAND_LENGTH + (2 * coordinate_count(command_class)) +
+            Command.FOOTER_LENGTH + Command.CHECK_LENGTH)
+
+
+def encode_packets(command_class, *columns):
+    '''
+    Encodes one packet for each row of the coordinate columns and returns
+    them as a (count, packet length) array of bytes. Each row is identical
+    to what command_class(*row).encode() gives, for example:
+
+        encode_packets(FillRectangle, x1s, y1s, x2s, y2s)
+
+    '''
+    if len(columns) != coordinate_count(command_class):
+        raise ValueError("%s takes %d coordinates, got %d" % (
+            command_class.__name__, coordinate_count(command_class),
+            len(columns)))
+    count = len(columns[0])
+    # coordinates go out big-endian, so lay them out that way and reinterpret
+    # the rows as the bytes of the packet data
+    coordinates = numpy.empty((count, len(columns)), dtype='>u2')
+    for i, column in enumerate(columns):
+        column = numpy.asarray(column)
+        # numpy would wrap these around rather than fail like struct does
+        if count and (column.min() < 0 or column.max() > COORDINATE_MAX):
+            raise ValueError("coordinates must be between 0 and %d" %
+                             COORDINATE_MAX)
+        coordinates[:, i] = column
+    length = packet_length(command_class)
+    data_end = 4 + len(columns) * 2
+
+    packets = numpy.empty((count, length), dtype=numpy.uint8)
+    packets[:, 0] = FRAME_HEADER
+    packets[:, 1] = length >> 8
+    packets[:, 2] = length & 0xff
+    packets[:, 3] = command_class.COMMAND[0]
+    packets[:, 4:data_end] = coordinates.view(numpy.uint8).reshape(count, -1)
+    packets[:, data_end:length - 1] = FRAME_FOOTER
+    packets[:, length - 1] = numpy.bitwise_xor.reduce(
+        packets[:, :length - 1], axis=1)
+    return packets
+
+
+def encode(command_class, *columns):
+    '''
+    Like encode_packets(), but returns all the packets joined as a single
+    byte string, ready to be handed to EPaper.send_packets().
+    '''
+    return encode_packets(command_class, *columns).tobytes()
@@ -0,0 +1,243 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import struct
+import heapq
+from concurrent.futures import Future
+
+from waveshare.epaper import DisplayText
+from waveshare.epaper import DrawCircle
+from waveshare.epaper import DrawRectangle
+from waveshare.epaper import DrawTriangle
+from waveshare.epaper import SetPallet
+from waveshare.epaper import SetEnFontSize
+from waveshare.epaper import SetZhFontSize
+from waveshare.responses import ResponseParser
+
+###############################################################################
+# Draw order optimizer
+###############################################################################
+
+# The state commands that drawing commands depend on and that can be moved
+# around them.
+PALLET = SetPallet.COMMAND[0]
+EN_FONT_SIZE = SetEnFontSize.COMMAND[0]
+ZH_FONT_SIZE = SetZhFontSize.COMMAND[0]
+ORDERED_STATE = [PALLET, EN_FONT_SIZE, ZH_FONT_SIZE]
+
+# Text is at most this tall, for when the font size isn't known.
+LARGEST_FONT = 64
+# Draws are only checked for overlap against earlier ones in the same bands
+# of this many rows, rather than against every earlier one.
+BAND_HEIGHT = 64
+
+
+def font_height(size):
+    '''
+    The height of text at a SetFontSize size, 32, 48 or 64 pixels.
+    '''
+    if size is None:
+        return LARGEST_FONT
+    return 16 + (16 * size[0])
+
+
+def shape_bounds(command):
+    '''
+    Returns the (x1, y1, x2, y2) box that a shape command paints inside of.
+    '''
+    data = command.convert_bytes()
+    if isinstance(command, DrawCircle):
+        x, y, r = struct.unpack(">HHH", data)
+        return (x - r, y - r, x + r, y + r)
+    if isinstance(command, DrawTriangle):
+        xs_ys = struct.unpack(">HHHHHH", data)
+        xs, ys = xs_ys[0::2], xs_ys[1::2]
+        return (min(xs), min(ys), max(xs), max(ys))
+    x1, y1, x2, y2 = struct.unpack(">HHHH", data)
+    return (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+
+
+def text_bounds(command, en_size, zh_size):
+    '''
+    Returns the box that DisplayText paints inside of, given the font sizes
+    in effect.  Characters are at most half as wide as they are tall per
+    byte, GB2312 characters being two bytes.
+    '''
+    data = command.convert_bytes()
+    x, y = struct.unpack(">HH", data[:4])
+    length = len(data[4:].split(b'\x00')[0])
+    height = max(font_height(en_size), font_height(zh_size))
+    return (x, y, x + (length * height // 2), y + height)
+
+
+def overlap(a, b):
+    return not (a[2] < b[0] or b[2] < a[0] or a[3] < b[1] or b[3] < a[1])
+
+
+def forward(result, future):
+    '''
+    Resolve the future with whatever the paper's send() gave back, which may
+    be a concurrent.futures.Future, a Twisted Deferred or nothing at all.
+    '''
+    def done(f):
+        if f.exception():
+            future.set_exception(f.exception())
+        else:
+            future.set_result(f.result())
+    if hasattr(result, 'add_done_callback'):
+        result.add_done_callback(done)
+    elif hasattr(result, 'addCallbacks'):
+        result.addCallbacks(
+            future.set_result,
+            lambda failure: future.set_exception(failure.value))
+    else:
+        future.set_result(result)
+
+
+class DrawOrder(object):
+    '''
+    Sits in front of an EPaper and holds back drawing commands so that they
+    can be sent grouped by the pallet and font sizes they are drawn with,
+    rather than switching back and forth between them as they were given:
+
+        with DrawOrder(paper) as draw:
+            draw.send(SetPallet(SetPallet.BLACK, SetPallet.WHITE))
+            draw.send(FillCircle(45, 515, 15))
+            ...
+
+    Only commands whose areas don't overlap are reordered, everything that
+    overlaps keeps its order, so what ends up painted is the same.  Other
+    commands such as ClearScreen and RefreshAndUpdate are sent in place and
+    nothing moves across them.  Once everything is sent the pallet and font
+    sizes are left as the last ones given.
+    '''
+    def __init__(self, paper):
+        '''
+        @param paper The EPaper (or anything with send() and frame() like
+                     it) to send the reordered commands to.
+        '''
+        self.paper = paper
+        # the state given so far, by command byte
+        self.state = {}
+        self.state_commands = {}
+        self.state_futures = {}
+        # (command, state it needs, bounds, future) for each held back draw
+        self.pending = []
+        # the state the paper has been sent, by command byte
+        self.sent = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.flush()
+
+    def send(self, command):
+        '''
+        Take a command to be sent.  Returns a concurrent.futures.Future that
+        resolves with the response of whatever command is sent for it once
+        that comes in.  A pallet or font size that turns out not to be
+        needed is resolved with "OK" without being sent.
+        '''
+        future = Future()
+        key = command.command[0]
+        if command.SETS_STATE and key in ORDERED_STATE:
+            if key not in self.state and self.pending:
+                # draws held back so far need the state from before
+                self.flush()
+            data = command.convert_bytes()
+            self.state[key] = data
+            self.state_commands[(key, data)] = command
+            self.state_futures.setdefault((key, data), []).append(future)
+        elif isinstance(command, (DrawCircle, DrawRectangle, DrawTriangle)):
+            needs = ((PALLET, self.state.get(PALLET)),)
+            self.pending.append((command, needs, shape_bounds(command),
+                                 future))
+        elif type(command) is DisplayText:
+            needs = tuple((key, self.state.get(key)) for key in ORDERED_STATE)
+            bounds = text_bounds(command, self.state.get(EN_FONT_SIZE),
+                                 self.state.get(ZH_FONT_SIZE))
+            self.pending.append((command, needs, bounds, future))
+        else:
+            self.flush()
+            forward(self.paper.send(command), future)
+        return future
+
+    def flush(self):
+        '''
+        Send everything held back, in the new order, then bring the paper to
+        the last pallet and font sizes given.
+        '''
+        with self.paper.frame():
+            for command, needs, bounds, future in self._ordered():
+                self._switch(needs)
+                forward(self.paper.send(command), future)
+            self.pending = []
+            self._switch(tuple(self.state.items()))
+        for futures in self.state_futures.values():
+            for future in futures:
+                future.set_result(ResponseParser.OK)
+        self.state_futures.clear()
+
+    def _switch(self, needs):
+        '''
+        Send the state commands needed to get to the given state.
+        '''
+        for key, data in needs:
+            if data is None or self.sent.get(key) == data:
+                continue
+            result = self.paper.send(self.state_commands[(key, data)])
+            for future in self.state_futures.pop((key, data), []):
+                forward(result, future)
+            self.sent[key] = data
+
+    def _ordered(self):
+        '''
+        Yields the pending draws, sticking with the current state for as long
+        as some draw that doesn't have to wait on another can use it.  When
+        none can, it switches to the state of the earliest one that can go.
+        '''
+        pending = self.pending
+        waiting_on = [0] * len(pending)
+        blocks = [[] for _ in pending]
+        # the draws so far that reach into each band of rows
+        bands = {}
+        for j in range(len(pending)):
+            bounds = pending[j][2]
+            earlier = set()
+            for band in range(bounds[1] // BAND_HEIGHT,
+                              bounds[3] // BAND_HEIGHT + 1):
+                in_band = bands.setdefault(band, [])
+                earlier.update(in_band)
+                in_band.append(j)
+            for i in earlier:
+                if overlap(pending[i][2], bounds):
+                    waiting_on[j] += 1
+                    blocks[i].append(j)
+
+        # draws that can go, as heaps of their positions by the state needed
+        ready = {}
+        def release(i):
+            heapq.heappush(ready.setdefault(pending[i][1], []), i)
+        for i in range(len(pending)):
+            if waiting_on[i] == 0:
+                release(i)
+
+        current = dict(self.sent)
+        while ready:
+            usable = [needs for needs in ready
+                      if all(data is None or current.get(key) == data
+                             for key, data in needs)]
+            needs = min(usable or ready, key=lambda needs: ready[needs][0])
+            i = heapq.heappop(ready[needs])
+            if not ready[needs]:
+                del ready[needs]
+            for key, data in needs:
+                if data is not None:
+                    current[key] = data
+            yield pending[i]
+            for j in blocks[i]:
+                waiting_on[j] -= 1
+                if waiting_on[j] == 0:
+                    release(j)
@@ -4,24 +4,53 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 
 
+import os
+import json
 import time
 import struct
-import serial
-
-import RPi.GPIO as GPIO
+from concurrent.futures import Future
+from concurrent.futures import CancelledError
+from concurrent.futures import wait
+from contextlib import contextmanager
+
+from waveshare.responses import ResponseParser
+from waveshare.responses import ResponseReader
+from waveshare.responses import command_name
+from waveshare.responses import GroupFuture
+from waveshare.flowcontrol import FlowWindow
+from waveshare.metrics import NULL_SINK
+from waveshare.lazy import LazyModule
+from waveshare.gpio import BOARD
+from waveshare.gpio import RPiGPIOBackend
+from waveshare.transport import SerialTransport
+
+# Not imported until a port is opened, so that everything else, such as
+# recording programs, starts quickly and works off of a Pi.
+serial = LazyModule("serial")
 
 ###############################################################################
 # base command class
 ###############################################################################
 
+# Compiled once rather than parsing a format string for every packet.
+PACKET_HEAD = struct.Struct('>BHB')
+COORDINATES_2 = struct.Struct('>HH')
+COORDINATES_3 = struct.Struct('>HHH')
+COORDINATES_4 = struct.Struct('>HHHH')
+COORDINATES_6 = struct.Struct('>HHHHHH')
+BAUDRATE = struct.Struct('>L')
+
 class Command(object):
     '''
     Commands used by the e ink display have a certain format that easily lends
     itself to objectification, so this is the base class for those commands.
 
     Child classes should only need to call the constructor of this class and
-    provide the new command and data content.
+    provide the new command and data content.  A drawing holds thousands of
+    commands, so they have no __dict__ and subclasses should declare empty
+    __slots__ too.
     '''
+    __slots__ = ('command', 'bytes')
 
     FRAME_HEADER = b'\xa5'
     FRAME_FOOTER = b'\xcc\x33\xc3\x3c'
@@ -32,6 +61,17 @@ class Command(object):
     CHECK_LENGTH = 1
     COMMAND = b'\x00'
     RESPONSE_BYTES = 0
+    # True if the response is a value, such as the baud rate, rather than
+    # "OK". RESPONSE_BYTES is then the most it can be.
+    RESPONSE_VALUE = False
+    # True if the command only sets a piece of device state, such as the
+    # pallet, that stays set until it is sent again with different data.
+    SETS_STATE = False
+    # True if send() shouldn't return until the command is out of the port,
+    # such as a refresh, rather than leaving it to a write-behind transport.
+    DRAIN = False
+    # True if a subclass changes how its packet is laid out.
+    OWN_ENCODING = False
 
     def __init__(self, command=None, data=None):
         self.command = command or self.COMMAND
@@ -79,6 +119,55 @@ class Command(object):
         packet = self._encode_packet()
         return packet + self.calculate_checksum(packet)
 
+    def encode_into(self, buffer, offset=0):
+        '''
+        Encodes the packet into a bytearray or writable memoryview at offset
+        rather than into new bytes objects, and returns its length.  The
+        result is the same as encode() gives; the checksum is worked out
+        from the fields as they are written rather than from the packet.
+
+        The buffer must have room for calculate_length() bytes from offset.
+        '''
+        if self.OWN_ENCODING:
+            packet = self.encode()
+            buffer[offset:offset + len(packet)] = packet
+            return len(packet)
+        data = self.bytes
+        size = len(data)
+        length = PACKET_OVERHEAD + size
+        command = self.command[0]
+        PACKET_HEAD.pack_into(buffer, offset, FRAME_HEADER_BYTE, length,
+                              command)
+        checksum = HEAD_CHECK ^ (length >> 8) ^ (length & 0xff) ^ command
+        position = offset + PACKET_HEAD.size
+        if isinstance(data, list):
+            for byte in data:
+                byte = byte[0]
+                buffer[position] = byte
+                checksum ^= byte
+                position += 1
+        else:
+            buffer[position:position + size] = data
+            for byte in data:
+                checksum ^= byte
+            position += size
+        end = position + FOOTER_SIZE
+        buffer[position:end] = FRAME_FOOTER
+        buffer[end] = checksum
+        return length
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # encode_into() can only write the fields itself if they are laid
+        # out and checked the usual way
+        cls.OWN_ENCODING = (cls.encode is not Command.encode or
+                            cls._encode_packet is not Command._encode_packet or
+                            cls.convert_bytes is not Command.convert_bytes or
+                            cls.calculate_length is not
+                            Command.calculate_length or
+                            cls.calculate_checksum is not
+                            Command.calculate_checksum)
+
     def __repr__(self):
         '''
         Returns a human readable string of hex digits corresponding to the
@@ -87,12 +176,48 @@ class Command(object):
         return u' '.join([u'%02x' % ord(b) for b in self.encode()])
 
 
+class FixedCommand(Command):
+    '''
+    A command without any data.  These are all the same whenever they are
+    sent, so one instance of each and its encoded packet are shared by
+    everything that makes one.
+    '''
+    __slots__ = ()
+
+    def __new__(cls):
+        shared = cls.__dict__.get('SHARED')
+        if shared is None:
+            shared = super().__new__(cls)
+            Command.__init__(shared)
+            cls.PACKET = Command.encode(shared)
+            cls.SHARED = shared
+        return shared
+
+    def __init__(self):
+        pass
+
+    def encode(self):
+        return self.PACKET
+
+
+# What encode_into() needs of Command, kept where looking it up is quick.
+FRAME_HEADER_BYTE = Command.FRAME_HEADER[0]
+FRAME_FOOTER = Command.FRAME_FOOTER
+FOOTER_SIZE = Command.FOOTER_LENGTH
+PACKET_OVERHEAD = (Command.HEADER_LENGTH + Command.LENGTH_LENGTH +
+                   Command.COMMAND_LENGTH + Command.FOOTER_LENGTH +
+                   Command.CHECK_LENGTH)
+# the header and footer bytes xor to this, so they needn't be gone over for
+# every packet
+HEAD_CHECK = (FRAME_HEADER_BYTE ^ FRAME_FOOTER[0] ^ FRAME_FOOTER[1] ^
+              FRAME_FOOTER[2] ^ FRAME_FOOTER[3])
+
 ###############################################################################
 # Configuration commands
 ###############################################################################
 
 
-class Handshake(Command):
+class Handshake(FixedCommand):
     '''
     Handshake or Null command.
 
@@ -101,7 +226,8 @@ class Handshake(Command):
     > Handshake command. If the module is ready, it will return an "OK".
 
     '''
-    RESPONSE_BYTES = 0
+    __slots__ = ()
+    RESPONSE_BYTES = 2
 
 class SetBaudrate(Command):
     '''
@@ -114,25 +240,28 @@ class SetBaudrate(Command):
     return the result after sending this command, since the host may take a
     period of time to change its Baud rate.
     '''
+    __slots__ = ()
     COMMAND = b'\x01'
     RESPONSE_BYTES = 2
 
     def __init__(self, baud):
-        super().__init__(SetBaudrate.COMMAND, struct.pack('>L', baud))
+        super().__init__(SetBaudrate.COMMAND, BAUDRATE.pack(baud))
 
 
-class ReadBaudrate(Command):
+class ReadBaudrate(FixedCommand):
     '''
     From the wiki:
 
     Return the current Baud rate value in ASCII format.
 
     '''
+    __slots__ = ()
     COMMAND = b'\x02'
     RESPONSE_BYTES = 6
+    RESPONSE_VALUE = True
 
 
-class ReadStorageMode(Command):
+class ReadStorageMode(FixedCommand):
     '''
     From the wiki:
     Return the information about the currently used storage area.
@@ -141,7 +270,10 @@ class ReadStorageMode(Command):
 
     1: MicroSD
     '''
+    __slots__ = ()
     COMMAND = b'\x06'
+    RESPONSE_BYTES = 1
+    RESPONSE_VALUE = True
 
 
 class SetStorageMode(Command):
@@ -151,7 +283,10 @@ class SetStorageMode(Command):
     Set the storage area to select the storage locations of font library and
     images, either the external TF card or the internal NandFlash is available.
     '''
+    __slots__ = ()
     COMMAND = b'\x07'
+    RESPONSE_BYTES = 2
+    SETS_STATE = True
     NAND_MODE = b'\x00'
     TF_MODE = b'\x01'
 
@@ -159,7 +294,7 @@ class SetStorageMode(Command):
         super().__init__(SetStorageMode.COMMAND, data=[target])
 
 
-class SleepMode(Command):
+class SleepMode(FixedCommand):
     '''
     GPIO must be used to wake it back up.
 
@@ -169,19 +304,24 @@ class SleepMode(Command):
     does not respond any commands. Only the rising edge on the pin WAKE_UP can
     wake up the system.
     '''
+    __slots__ = ()
     COMMAND = b'\x08'
+    # the wake up pin does nothing until this has got to the module
+    DRAIN = True
 
 
-class RefreshAndUpdate(Command):
+class RefreshAndUpdate(FixedCommand):
     '''
     From the wiki:
     Refresh and update the display at once.
     '''
+    __slots__ = ()
     COMMAND = b'\x0a'
     RESPONSE_BYTES = 2
+    DRAIN = True
 
 
-class CurrentDisplayRotation(Command):
+class CurrentDisplayRotation(FixedCommand):
     '''
     From the wiki:
     Return the current display direction
@@ -190,7 +330,10 @@ class CurrentDisplayRotation(Command):
 
     1 or 2: 180° rotation (depending on Firmware)
     '''
+    __slots__ = ()
     COMMAND = b'\x0c'
+    RESPONSE_BYTES = 1
+    RESPONSE_VALUE = True
 
 
 class SetCurrentDisplayRotation(Command):
@@ -202,8 +345,10 @@ class SetCurrentDisplayRotation(Command):
 
     0x01 or 0x02: 180° rotation (depending on Firmware)
     '''
+    __slots__ = ()
     COMMAND = b'\x0d'
     RESPONSE_BYTES = 2
+    SETS_STATE = True
 
     NORMAL = b'\x00'
     FLIP = b'\x01'
@@ -212,7 +357,7 @@ class SetCurrentDisplayRotation(Command):
         super().__init__( SetCurrentDisplayRotation.COMMAND, rotation)
 
 
-class ImportFontLibrary(Command):
+class ImportFontLibrary(FixedCommand):
     '''
     From the wiki:
     Import font library: 48MB
@@ -221,17 +366,17 @@ class ImportFontLibrary(Command):
     The font library files include GBK32.FON/GBK48.FON/GBK64.FON. The state
     indicator will flicker 3 times when the importation is start and ending.
     '''
+    __slots__ = ()
     COMMAND = b'\x0e'
 
 
-class ImportImage(Command):
+class ImportImage(FixedCommand):
     '''
     From the wiki:
     Import image: 80MB
     '''
+    __slots__ = ()
     COMMAND = b'\x0f'
-    def __init__(self):
-        super().__init__(ImportImage.COMMAND)
 
 
 class SetPallet(Command):
@@ -241,8 +386,10 @@ class SetPallet(Command):
     foreground color can be used to display the basic drawings and text, while
     the background color is used to clear the screen.
     '''
+    __slots__ = ()
     COMMAND = b'\x10'
     RESPONSE_BYTES = 2
+    SETS_STATE = True
 
     BLACK = b'\x00'
     DARK_GRAY = b'\x01'
@@ -254,23 +401,28 @@ class SetPallet(Command):
         super().__init__(SetPallet.COMMAND, [fg, bg])
 
 
-class GetPallet(Command):
+class GetPallet(FixedCommand):
     '''
     From the wiki:
     For example, when returns "03", "0" means the foreground color is Black and
     "3" means the background color is White.
     '''
+    __slots__ = ()
     COMMAND = b'\x11'
+    RESPONSE_BYTES = 2
+    RESPONSE_VALUE = True
 
 
 class SetFontSize(Command):
     '''
     Common parent for font size setting commands.
     '''
+    __slots__ = ()
     THIRTYTWO = b'\x01'
     FOURTYEIGHT = b'\x02'
     SIXTYFOUR = b'\x03'
     RESPONSE_BYTES = 2
+    SETS_STATE = True
     def __init__(self, command, size=THIRTYTWO):
         super().__init__(command, [size])
 
@@ -280,6 +432,7 @@ class SetEnFontSize(SetFontSize):
     From the wiki:
     Set the English font size (0x1E or 0x1F, may differ depending on version).
     '''
+    __slots__ = ()
     COMMAND = b'\x1e'
     RESPONSE_BYTES = 2
     def __init__(self, size=SetFontSize.THIRTYTWO):
@@ -291,6 +444,7 @@ class SetZhFontSize(SetFontSize):
     From the wiki:
     Set the Chinese font size (0x1F).
     '''
+    __slots__ = ()
     COMMAND = b'\x1f'
     RESPONSE_BYTES = 2
     def __init__(self, size=SetEnFontSize.THIRTYTWO):
@@ -311,11 +465,12 @@ class DisplayText(Command):
     Display a character string on a specified coordination position. Chinese
     and English mixed display is supported.
     '''
+    __slots__ = ()
     COMMAND = b'\x30'
     RESPONSE_BYTES = 2
     def __init__(self, x, y, text):
         super().__init__(self.COMMAND,
-                         struct.pack(">HH", x, y) + text + b'\x00')
+                         COORDINATES_2.pack(x, y) + text + b'\x00')
 
 class DisplayImage(DisplayText):
     '''
@@ -338,6 +493,7 @@ class DisplayImage(DisplayText):
     in which the ending "0" is included. For example, PIC7.BMP and PIC789.BMP
     are correct bitmap names, while PIC7890.BMP is a wrong bitmap namem.
     '''
+    __slots__ = ()
     COMMAND = b'\x70'
     RESPONSE_BYTES = 2
 
@@ -352,10 +508,11 @@ class DrawCircle(Command):
     From the wiki:
     Draw a circle based on the given center coordination and radius.
     '''
+    __slots__ = ()
     COMMAND = b'\x26'
     RESPONSE_BYTES = 2
     def __init__(self, x, y, radius):
-        super().__init__(self.COMMAND, struct.pack(">HHH", x, y, radius))
+        super().__init__(self.COMMAND, COORDINATES_3.pack(x, y, radius))
 
 
 class FillCircle(DrawCircle):
@@ -363,6 +520,7 @@ class FillCircle(DrawCircle):
     From the wiki:
     Fill a circle based on the given center coordination and radius.
     '''
+    __slots__ = ()
     COMMAND = b'\x27'
     RESPONSE_BYTES = 2
 
@@ -372,11 +530,12 @@ class DrawTriangle(Command):
     From the wiki:
     Draw a tri-angle according to three given point coordinates.
     '''
+    __slots__ = ()
     COMMAND = b'\x28'
     RESPONSE_BYTES = 2
     def __init__(self, x1, y1, x2, y2, x3, y3):
-        super().__init__(self.COMMAND, struct.pack(">HHHHHH", x1, y1, x2, y2,
-                                                   x3, y3))
+        super().__init__(self.COMMAND, COORDINATES_6.pack(x1, y1, x2, y2,
+                                                      x3, y3))
 
 
 class FillTriangle(DrawTriangle):
@@ -384,6 +543,7 @@ class FillTriangle(DrawTriangle):
     From the wiki:
     Fill a tri-angle according to three given point coordinates.
     '''
+    __slots__ = ()
     COMMAND = b'\x29'
     RESPONSE_BYTES = 2
 
@@ -394,10 +554,11 @@ class DrawRectangle(Command):
     Draw a rectangle according to two point coordinates with foreground color,
     in which these two points serve as the diagonal points of the rectangle.
     '''
+    __slots__ = ()
     COMMAND = b'\x25'
     RESPONSE_BYTES = 2
     def __init__(self, x1, y1, x2, y2):
-        super().__init__(self.COMMAND, struct.pack(">HHHH", x1, y1, x2, y2))
+        super().__init__(self.COMMAND, COORDINATES_4.pack(x1, y1, x2, y2))
 
 
 class FillRectangle(DrawRectangle):
@@ -406,15 +567,17 @@ class FillRectangle(DrawRectangle):
     Draw a rectangle according to two point coordinates with foreground color,
     in which these two points serve as the diagonal points of the rectangle.
     '''
+    __slots__ = ()
     COMMAND = b'\x24'
     RESPONSE_BYTES = 2
 
 
-class ClearScreen(Command):
+class ClearScreen(FixedCommand):
     '''
     From the wiki:
     Clear the screen with the background color.
     '''
+    __slots__ = ()
     COMMAND = b'\x2e'
     RESPONSE_BYTES = 2
 
@@ -428,7 +591,29 @@ PORT_DEVICE = "/dev/ttyAMA0"
 PIN_RESET = 3
 PIN_WAKEUP = 7
 
-RESPONSE_READ_THRESHOLD = 600
+# The module always powers up at 115200 baud. negotiate_baudrate() can step
+# it up through these, and remembers what worked in BAUDRATE_CACHE.
+DEFAULT_BAUDRATE = 115200
+BAUDRATES = [115200, 230400, 460800, 921600]
+BAUDRATE_CACHE = os.path.expanduser("~/.cache/waveshare-epaper/baudrate.json")
+# From the wiki, the module may take 100ms to answer SetBaudrate while the
+# host switches rates.
+BAUDRATE_SWITCH_DELAY = 0.1
+# How long the module takes to come back up after a reset.
+RESET_DELAY = 2
+# wait_ready() waits this long for the answer to its first handshake, twice
+# as long for each one after up to READY_POLL_MAX, and gives up after
+# READY_TIMEOUT.
+READY_POLL = 0.05
+READY_POLL_MAX = 0.2
+READY_TIMEOUT = 10
+# How long the device has to be quiet before a response that could still be
+# growing (an error code or a value) is taken as complete.
+READ_IDLE = 0.05
+
+# Size of the buffer that commands sent inside a frame are gathered into
+# before being written to the serial device.
+FRAME_BUFFER_SIZE = 4096
 
 class EPaper(object):
     '''
@@ -439,33 +624,64 @@ class EPaper(object):
     for more info.
     '''
     def __init__(self, port=PORT_DEVICE, reset=PIN_RESET, wakeup=PIN_WAKEUP,
-                 mode=GPIO.BOARD):
+                 mode=BOARD, window=None, metrics=None, elide=True,
+                 gpio=None, transport=None):
         '''
         Makes an EPaper object that will read and write from the specified
         serial device (file name).
 
-        Note: This class makes use of the Raspberry PI GPIO functions, the
-        caller should invoke GPIO.cleanup() before exiting.
+        Note: The reset and wakeup pins are driven through RPi.GPIO unless
+        another backend from waveshare.gpio is given, and are cleaned up by
+        close().  Several can be used at once on different ports and pins,
+        with mode=None for all but the first.
 
         @param port The file name to open.
         @param reset The GPIO pin to use for resets.
         @param wakeup The GPIO pin to use for wakeups.
         @param mode The mode of GPIO pin addressing (GPIO.BOARD is the default).
+        @param window The FlowWindow limiting how many commands are sent ahead
+                      of their responses (a default one if None).
+        @param metrics The sink from waveshare.metrics to report commands,
+                       bytes and latencies to (nothing is kept if None).
+        @param elide Drop commands that would set the device to the state it
+                     is already known to be in.
+        @param gpio The waveshare.gpio backend for the reset and wakeup pins,
+                    an RPiGPIOBackend in mode if None.
+        @param transport How bytes get onto the port, such as a
+                         waveshare.transport.WriteBehindTransport, written
+                         straight from the caller's thread if None.
         '''
-        self.serial = serial.Serial(port)
-        self.serial.baudrate = 115200 # default for device
-        self.serial.bytesize = serial.EIGHTBITS
-        self.serial.parity = serial.PARITY_NONE
-
-        if mode:
-            GPIO.setmode(mode)
-        GPIO.setup(reset, GPIO.OUT)
-        GPIO.setup(wakeup, GPIO.OUT)
-
+        self.port = port
         self.reset_pin = reset
         self.wakeup_pin = wakeup
 
-        self.bytes_expected = 0
+        # the pins first, so that a pin another panel has doesn't leave the
+        # port open, and they are let go again if the port can't be opened
+        self.gpio = gpio or RPiGPIOBackend(mode)
+        self.gpio.setup_outputs([reset, wakeup])
+        try:
+            self.serial = serial.Serial(port)
+            self.serial.baudrate = DEFAULT_BAUDRATE
+            self.serial.bytesize = serial.EIGHTBITS
+            self.serial.parity = serial.PARITY_NONE
+        except Exception:
+            self.gpio.release([reset, wakeup])
+            raise
+        self.transport = (transport or SerialTransport()).attach(self.serial)
+
+        self.responses = ResponseParser()
+        self.reader = None
+        self.window = window or FlowWindow()
+        self.metrics = metrics or NULL_SINK
+        self.responses.add_listener(self._response_received)
+
+        # the data last sent with each SETS_STATE command, by command byte
+        self.elide = elide
+        self.state = {}
+
+        self.frame_buffer = bytearray(FRAME_BUFFER_SIZE)
+        self.frame_length = 0
+        self.frame_depth = 0
 
     def __enter__(self):
         '''
@@ -476,67 +692,584 @@ class EPaper(object):
 
     def __exit__(self ,type, value, traceback):
         '''
-        Invokes the GPIO.cleanup() method.  If that's not a desired behavior,
-        don't use the with clause.
+        Invokes close().  If that's not a desired behavior, don't use the
+        with clause.
         '''
-        GPIO.cleanup()
+        self.close()
 
+    def close(self):
+        '''
+        Stop the background reader, close the serial port and clean up this
+        object's GPIO pins, leaving any others alone.
+        '''
+        self.stop_reader()
+        self.transport.close()
+        self.serial.close()
+        self.gpio.release([self.reset_pin, self.wakeup_pin])
+
+    @property
+    def bytes_expected(self):
+        '''
+        The number of response bytes still owed by the device for the
+        commands that have been sent.
+        '''
+        return self.responses.bytes_expected
+
+    def start_reader(self):
+        '''
+        Start reading responses in a background thread.  The futures returned
+        by send() then resolve on their own as the device answers, and
+        read_responses() only waits on them.
+        '''
+        if self.reader:
+            return
+        self.flush()
+        self.reader = ResponseReader(self.serial, self.responses)
+        self.reader.start()
+
+    def stop_reader(self):
+        '''
+        Stop the background reader thread if it is running.
+        '''
+        if not self.reader:
+            return
+        self.reader.stop()
+        self.reader = None
+
+
+    def negotiate_baudrate(self, rates=BAUDRATES, cache=BAUDRATE_CACHE,
+                           timeout=0.5):
+        '''
+        Step the module and the serial port up to the fastest of the given
+        baud rates at which the module still answers a handshake and reads
+        back the rate it was set to.  Any failure falls back to the last rate
+        that worked, resetting the module if it can't be reached anymore.
+
+        The result is saved per port in the cache file (None to not use one)
+        so that a restart can pick up where the module was left at, since it
+        only goes back to 115200 when it is power cycled or reset.  Rates
+        above the cached one aren't tried again.
+
+        Returns the baud rate in use.
+        '''
+        restart_reader = self.reader is not None
+        self.stop_reader()
+        if self.bytes_expected:
+            self.read_responses()
+            self._drop_responses()
+        try:
+            cached = self._load_baudrate(cache)
+            current = self._find_baudrate(cached, timeout)
+            for rate in sorted(rates):
+                if rate <= current:
+                    continue
+                if cached and rate > cached:
+                    break
+                if not self._switch_baudrate(rate, timeout):
+                    print("baud rate %d failed, falling back to %d" %
+                          (rate, current))
+                    current = self._restore_baudrate(current, timeout)
+                    break
+                current = rate
+            self._save_baudrate(cache, current)
+        finally:
+            self.window.reset()
+            if restart_reader:
+                self.start_reader()
+        return current
+
+    def _load_baudrate(self, cache):
+        if not cache:
+            return None
+        try:
+            with open(cache, "r") as f:
+                return json.load(f).get(self.port)
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def _save_baudrate(self, cache, rate):
+        if not cache:
+            return
+        try:
+            with open(cache, "r") as f:
+                rates = json.load(f)
+        except (OSError, ValueError):
+            rates = {}
+        rates[self.port] = rate
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            with open(cache, "w") as f:
+                json.dump(rates, f)
+        except OSError as e:
+            # the module is at the rate all the same, it is only that the
+            # next run will have to find it again
+            print("couldn't save the baud rate to %s: %s" % (cache, e))
+            self.metrics.count("epaper.baudrate_cache_failed")
+
+    def _set_host_baudrate(self, rate):
+        # let everything written at the old rate go out before switching
+        self.drain()
+        self.serial.baudrate = rate
+
+    def _drop_responses(self, reason="response lost while changing baud "
+                                     "rate"):
+        self.forget_state()
+        self.responses.fail(serial.SerialTimeoutException(reason))
+        if not self.reader:
+            self.serial.reset_input_buffer()
+
+    def _check_link(self, rate, timeout):
+        '''
+        Returns True if the module answers a handshake and reports the given
+        baud rate.  Both packets being accepted also means their checksums
+        made it across intact.
+        '''
+        handshake = self.send(Handshake())
+        baudrate = self.send(ReadBaudrate())
+        self.read_responses(timeout=timeout)
+        if not (handshake.done() and baudrate.done()):
+            self._drop_responses()
+            return False
+        if handshake.exception() or baudrate.exception():
+            return False
+        return (handshake.result() == ResponseParser.OK and
+                baudrate.result() == str(rate).encode())
+
+    def _find_baudrate(self, cached, timeout):
+        '''
+        Find the rate the module is at, trying the cached one first and
+        resetting the module if it doesn't answer at all.
+        '''
+        for rate in [cached, DEFAULT_BAUDRATE]:
+            if not rate:
+                continue
+            self._set_host_baudrate(rate)
+            if self._check_link(rate, timeout):
+                return rate
+        self._reset_baudrate()
+        if self._check_link(DEFAULT_BAUDRATE, timeout):
+            return DEFAULT_BAUDRATE
+        raise serial.SerialException("no response from the module at %s" %
+                                     self.port)
+
+    def _switch_baudrate(self, rate, timeout):
+        '''
+        Move the module and the host to the rate and check that they can
+        still talk.
+        '''
+        future = self.send(SetBaudrate(rate))
+        self._set_host_baudrate(rate)
+        time.sleep(BAUDRATE_SWITCH_DELAY)
+        # the module answers at the new rate
+        self.read_responses(timeout=timeout)
+        if not future.done():
+            self._drop_responses()
+        return self._check_link(rate, timeout)
+
+    def _reset_baudrate(self):
+        self.reset()
+        time.sleep(RESET_DELAY)
+        self._set_host_baudrate(DEFAULT_BAUDRATE)
+        self._drop_responses()
+
+    def _restore_baudrate(self, rate, timeout):
+        '''
+        Get back to a rate that worked before, from an unknown state.
+        '''
+        self._reset_baudrate()
+        if rate == DEFAULT_BAUDRATE or self._switch_baudrate(rate, timeout):
+            return rate
+        self._reset_baudrate()
+        return DEFAULT_BAUDRATE
+
+    def wait_ready(self, timeout=READY_TIMEOUT, poll=READY_POLL,
+                   max_poll=READY_POLL_MAX):
+        '''
+        Poll the module with handshakes until it answers "OK", such as after
+        powering up, a reset or a wake up.  Each handshake is given twice as
+        long to be answered as the one before, from poll up to max_poll, so
+        a module that is already up is found within a few milliseconds and
+        one that is still booting isn't flooded.
+
+        Commands sent before are given a chance to be answered first, so that
+        the answer to a handshake isn't taken for one of theirs, and those
+        that aren't fail with serial.SerialTimeoutException.
+
+        Returns how many seconds it took, which is also reported as the
+        epaper.wait_ready timing.  Raises serial.SerialTimeoutException if
+        the module hasn't answered within timeout seconds.
+        '''
+        start = time.monotonic()
+        deadline = start + timeout
+        if self.bytes_expected:
+            self.read_responses(timeout=min(self.window.timeout, timeout))
+            if self.bytes_expected:
+                self._drop_responses("no answer before waiting for the "
+                                     "module to be ready")
+        while True:
+            handshake = self.send(Handshake())
+            remaining = deadline - time.monotonic()
+            self.read_responses(timeout=max(0, min(poll, remaining)))
+            if handshake.done():
+                if (not handshake.exception() and
+                        handshake.result() == ResponseParser.OK):
+                    break
+                # answered with an error, don't pester it
+                time.sleep(max(0, min(poll, deadline - time.monotonic())))
+            else:
+                # a module that isn't up yet ignores what it is sent
+                self._drop_probe(handshake)
+            if time.monotonic() >= deadline:
+                raise serial.SerialTimeoutException(
+                    "no handshake from the module at %s within %0.1f "
+                    "seconds" % (self.port, timeout))
+            poll = min(poll * 2, max_poll)
+        elapsed = time.monotonic() - start
+        if self.metrics.enabled:
+            self.metrics.timing("epaper.wait_ready", elapsed)
+        return elapsed
+
+    def _drop_probe(self, handshake):
+        # give up on the handshake alone, anything sent since by another
+        # thread is left waiting
+        self.forget_state()
+        self.responses.abandon(handshake, serial.SerialTimeoutException(
+            "no answer while waiting for the module to be ready"))
+        if not self.reader and not self.bytes_expected:
+            self.serial.reset_input_buffer()
 
     def reset(self):
         '''
         Reset the display by setting the reset pin to high and then low.
+        Commands still waiting on a response won't get one, their futures
+        fail with serial.SerialTimeoutException.
         '''
-        GPIO.output(self.reset_pin, GPIO.HIGH)
-        GPIO.output(self.reset_pin, GPIO.LOW)
+        self.flush()
+        if self.bytes_expected:
+            self._drop_responses("the module was reset")
+        self.forget_state()
+        self._pulse(self.reset_pin, "epaper.reset_pulse")
 
     def sleep(self):
         '''
         Tell the display to go to sleep.
         '''
-        self.serial.write(SleepMode().encode())
+        self.send(SleepMode())
 
     def wake(self):
         '''
         Tell the device to wake up.  It only makes sense to do this after
         telling it to sleep.
         '''
-        GPIO.output(self.wakeup_pin, GPIO.HIGH)
-        GPIO.output(self.wakeup_pin, GPIO.LOW)
+        self.forget_state()
+        self._pulse(self.wakeup_pin, "epaper.wake_pulse")
+
+    def _pulse(self, pin, name):
+        seconds = self.gpio.pulse(pin)
+        if self.metrics.enabled:
+            self.metrics.timing(name, seconds)
 
     def update(self):
         '''
         Update the display.
         '''
-        self.serial.write(RefreshAndUpdate().encode())
+        self.send(RefreshAndUpdate())
+
+    def forget_state(self):
+        '''
+        Stop assuming anything about the device's state, so that the next
+        command setting each piece of it is sent.  This is done on a reset, a
+        wake up and on errors, and should be done by anyone changing the
+        state behind this object's back.
+        '''
+        self.state.clear()
+
+    @contextmanager
+    def frame(self):
+        '''
+        Batches every command sent inside the with clause into one buffer
+        which is written to the device in as few writes as possible, rather
+        than one write per command.  Frames may be nested, the buffer is
+        flushed when the outermost one exits.
+        '''
+        self.frame_depth += 1
+        try:
+            yield self
+        finally:
+            self.frame_depth -= 1
+            if self.frame_depth == 0:
+                self.flush()
+
+    def flush(self):
+        '''
+        Write out any commands that are waiting in the frame buffer.
+        '''
+        if self.frame_length == 0:
+            return
+        with self.metrics.span("epaper.write"):
+            self._write_out(
+                memoryview(self.frame_buffer)[:self.frame_length])
+        self.frame_length = 0
+
+    def drain(self, timeout=None):
+        '''
+        Write out the frame buffer and wait for everything sent so far to be
+        out of the port.  Returns False if it isn't within timeout seconds.
+        '''
+        self.flush()
+        return self.transport.drain(timeout)
+
+    def _write_out(self, data):
+        # the commands registered so far are sent once the transport has
+        # written this out, which may be later for a write-behind one
+        registered = self.responses.registered
+        self.transport.write(data, lambda: self.responses.sent(registered))
+
+    def _write(self, packet):
+        '''
+        Write an encoded packet to the device, or to the frame buffer if a
+        frame is open.
+        '''
+        if self.frame_depth == 0:
+            self._write_out(packet)
+            return
+        length = len(packet)
+        if self.frame_length + length > len(self.frame_buffer):
+            self.flush()
+            if length > len(self.frame_buffer):
+                self._write_out(packet)
+                return
+        end = self.frame_length + length
+        self.frame_buffer[self.frame_length:end] = packet
+        self.frame_length += length
+
+    def _write_command(self, command, length):
+        '''
+        Encode a command straight into the frame buffer, which is written
+        out right away unless a frame is open.
+        '''
+        if self.frame_length + length > len(self.frame_buffer):
+            self.flush()
+            if length > len(self.frame_buffer):
+                self._write(command.encode())
+                return
+        command.encode_into(self.frame_buffer, self.frame_length)
+        self.frame_length += length
+        if self.frame_depth == 0:
+            self.flush()
 
     def send(self, command):
         '''
         Send the provided command to the device, does not wait for a response
         or sleep or make any other considerations.
+
+        Returns a concurrent.futures.Future that resolves with the response
+        to this command, or fails with a ResponseError if the device reports
+        an error.  It resolves as responses are read by read_responses() or
+        by the background reader.
+
+        A command that sets state the device is already known to have isn't
+        sent at all, its future is resolved with "OK" right away.
         '''
-        self.bytes_expected += command.RESPONSE_BYTES
-        self.serial.write(command.encode())
-        if self.bytes_expected >= RESPONSE_READ_THRESHOLD:
-            self.read_responses()
+        if command.SETS_STATE and self.elide:
+            data = command.convert_bytes()
+            if self.state.get(command.command) == data:
+                return self._elided(command)
+            self.state[command.command] = data
+        return self._send_packet(command)
+
+    def _elided(self, command):
+        if self.metrics.enabled:
+            self.metrics.count("epaper.elided.%s" % command_name(command))
+        future = Future()
+        future.set_result(ResponseParser.OK)
+        return future
+
+    def send_packets(self, data, packet_length, command_class):
+        '''
+        Send a run of already encoded packets of one command class that all
+        have the same length, such as those made by waveshare.bulk.encode().
+        Returns a list with a future per packet, like send().
+        '''
+        view = memoryview(data)
+        return [self._send_packet(command_class,
+                                  view[start:start + packet_length])
+                for start in range(0, len(view), packet_length)]
+
+    def send_program(self, program, cancel=None):
+        '''
+        Send the packets of a waveshare.program.Program, which may be of any
+        commands, as they are.  They are written in runs as large as the
+        flow control window allows, straight from the program's buffer.
+
+        Returns one future that resolves once every packet has its response,
+        or fails with the first ResponseError.  The program may change any
+        of the device's state, so nothing is assumed about it afterwards.
+
+        If the cancel threading.Event is set, the rest of the program isn't
+        sent, the future is cancelled and CancelledError is raised.
+        '''
+        future = GroupFuture(len(program))
+        offsets = program.offsets
+        start = 0
+        while start < len(program):
+            if cancel is not None and cancel.is_set():
+                self.forget_state()
+                # the rest was never expected, so it can't resolve
+                future.cancel()
+                raise CancelledError()
+            room = self.window.limit() - self.responses.in_flight
+            if room <= 0:
+                if self._wait_for_response():
+                    continue
+                room = 1
+            end = min(start + room, len(program))
+            for index in range(start, end):
+                command = program.command_class(index)
+                self._expect(command, offsets[index + 1] - offsets[index],
+                             future)
+                if command.DRAIN:
+                    # a run stops at a command that is drained after
+                    end = index + 1
+                    break
+            self._write(program.data[offsets[start]:offsets[end]])
+            self._written(command)
+            start = end
+        if self.metrics.enabled:
+            self.metrics.count("epaper.program_packets", len(program))
+            self.metrics.count("epaper.program_bytes", offsets[len(program)])
+        self.forget_state()
+        return future
+
+    def _send_packet(self, command, packet=None):
+        '''
+        Send an encoded packet once the flow control window allows another
+        command to be waiting on a response.  Without a packet, the command
+        is encoded into the frame buffer as it is written.
+        '''
+        if command.RESPONSE_BYTES:
+            while self.responses.in_flight >= self.window.limit():
+                if not self._wait_for_response():
+                    break
+        length = command.calculate_length() if packet is None else len(packet)
+        future = self._expect(command, length, Future())
+        if packet is None:
+            self._write_command(command, length)
+        else:
+            self._write(packet)
+        self._written(command)
+        return future
+
+    def _expect(self, command, length, future):
+        '''
+        Account for a command of the encoded length about to be written and
+        register the future for its response.
+        '''
+        if self.metrics.enabled:
+            self.metrics.command(command_name(command), length)
+        return self.responses.expect(command, future)
+
+    def _written(self, command):
+        '''
+        Called once a command has been written, or put in the frame buffer.
+        A command such as RefreshAndUpdate is only done with once everything
+        up to it is out of the port.
+        '''
+        if command.DRAIN:
+            self.drain()
+
+    def _wait_for_response(self):
+        '''
+        Wait for the oldest command to get its response.  Returns False if it
+        didn't come back within the window's timeout.  This doesn't go by the
+        oldest command's future, which may be shared with others such as by
+        send_program().
+        '''
+        self.flush()
+        oldest = self.responses.oldest()
+        if not oldest:
+            return True
+        command, future = oldest
+        in_flight = self.responses.in_flight
+        if self.reader:
+            self.responses.wait(in_flight, self.window.timeout)
+        else:
+            while self.responses.in_flight >= in_flight:
+                partial = self.responses.buffered
+                size = max(command.RESPONSE_BYTES, self.serial.in_waiting)
+                b = self.read(size=size, timeout=READ_IDLE if partial
+                              else self.window.timeout)
+                if not b:
+                    self.responses.idle()
+                    if partial:
+                        continue
+                    break
+                self.responses.feed(b)
+        if self.responses.in_flight < in_flight:
+            return True
+        self.forget_state()
+        self.window.overrun()
+        return False
+
+    def _response_received(self, command, kind, latency, in_flight):
+        if kind == 'error':
+            # the command may not have taken, nor ones that were garbled
+            # along with it
+            self.forget_state()
+            self.window.overrun()
+        elif latency is not None:
+            self.window.acked(latency, in_flight)
+        if self.metrics.enabled:
+            name = command_name(command)
+            if kind == 'error':
+                self.metrics.count("epaper.error.%s" % name)
+            if latency is not None:
+                self.metrics.timing("epaper.response.%s" % name, latency)
 
     def read(self, size=100, timeout=5):
         '''
-        Read a response from the underlying serial device.
+        Read a response from the underlying serial device.  This competes
+        with the background reader for bytes, so don't use it while that is
+        running.
         '''
-        start_time = time.time()
-        self.serial.timeout = timeout
-        b = self.serial.read(size)
-        #print("read took %0.2f seconds. expected: %d got: %d data: %s" % (
-        #    time.time() - start_time, size, len(b), b.hex()))
+        self.flush()
+        with self.metrics.span("epaper.read"):
+            if self.serial.timeout != timeout:
+                self.serial.timeout = timeout
+            b = self.serial.read(size)
+        if self.metrics.enabled:
+            self.metrics.count("epaper.read_bytes", len(b))
         return b
 
     def read_responses(self, timeout=3):
+        '''
+        Wait for the responses to every command sent so far, for up to
+        timeout seconds, resolving their futures.
+        '''
+        self.flush()
         if self.bytes_expected == 0:
-            print("no response expected")
             return
-        start_time = time.time()
-        #print("reading expected response bytes: %d" % self.bytes_expected)
-        b = self.read(size=self.bytes_expected, timeout=timeout)
-        #print("read: %d, read time: %0.2f" % (len(b),
-        #                                      time.time() - start_time))
-        self.bytes_expected -= len(b)
+        with self.metrics.span("epaper.read_responses"):
+            self._read_responses(timeout)
+
+    def _read_responses(self, timeout):
+        if self.reader:
+            wait(self.responses.futures(), timeout=timeout)
+            return
+        deadline = time.time() + timeout
+        # responses such as errors and values can be a different length than
+        # expected, so keep reading until all are matched up or time is up
+        while self.bytes_expected > 0 and time.time() < deadline:
+            partial = self.responses.buffered
+            remaining = deadline - time.time()
+            b = self.read(size=self.bytes_expected,
+                          timeout=min(READ_IDLE, remaining) if partial
+                          else remaining)
+            if not b:
+                # once quiet, what was read of a response is all of it
+                self.responses.idle()
+                if partial:
+                    continue
+                break
+            self.responses.feed(b)
+        self.responses.idle()
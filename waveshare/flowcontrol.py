@@ -0,0 +1,107 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+###############################################################################
+# Flow control
+###############################################################################
+
+class FlowWindow(object):
+    '''
+    A sliding window on the number of commands that may be sent to the
+    device without their responses having come back yet.
+
+    The device executes commands one at a time from a small input buffer, so
+    sending too far ahead overruns that buffer and sending too little leaves
+    the UART idle. The window is sized from the response latency, in the way
+    TCP Vegas sizes its congestion window: the lowest latency seen is taken as
+    the cost of a command that didn't have to wait, and anything above that
+    is time spent queued in the device. From that an estimate of the number
+    of commands queued in the device is kept between `low` and `high`, so
+    that there is always another command ready without piling up more.
+
+    Until the queue first builds up, the window grows by one for each
+    response, which doubles it for every round trip. An error response or a
+    response that doesn't come back in time is taken as an overrun and
+    halves the window.
+    '''
+    INITIAL = 8
+    MINIMUM = 1
+    MAXIMUM = 300
+    LOW = 2
+    HIGH = 6
+    # weight of each new sample in the smoothed latency
+    SMOOTHING = 0.125
+    # how long to wait for a response before it is considered lost
+    TIMEOUT = 3
+
+    def __init__(self, size=INITIAL, minimum=MINIMUM, maximum=MAXIMUM,
+                 low=LOW, high=HIGH, timeout=TIMEOUT):
+        self.size = float(size)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.low = low
+        self.high = high
+        self.timeout = timeout
+        self.slow_start = True
+        self.base_latency = None
+        self.latency = None
+        self.acks = 0
+        self.overruns = 0
+
+    def reset(self):
+        '''
+        Forget the latencies seen so far, such as after the link speed has
+        changed, and start growing the window again.
+        '''
+        self.slow_start = True
+        self.base_latency = None
+        self.latency = None
+
+    def limit(self):
+        '''
+        The number of commands that may be waiting on responses right now.
+        '''
+        return int(self.size)
+
+    def queued(self, in_flight):
+        '''
+        Estimate of how many of the in flight commands are sitting in the
+        device's buffer waiting to be executed.
+        '''
+        if not self.latency:
+            return 0.0
+        return in_flight * (1.0 - (self.base_latency / self.latency))
+
+    def acked(self, latency, in_flight):
+        '''
+        Adjust the window for a response that took latency seconds to come
+        back, with in_flight commands sent at the time.
+        '''
+        self.acks += 1
+        if self.base_latency is None or latency < self.base_latency:
+            self.base_latency = latency
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.SMOOTHING * (latency - self.latency)
+
+        queued = self.queued(in_flight)
+        if queued > self.high:
+            self.slow_start = False
+            # shrink by one per round trip
+            self.size -= 1.0 / self.size
+        elif self.slow_start:
+            self.size += 1.0
+        elif queued < self.low:
+            # grow by one per round trip
+            self.size += 1.0 / self.size
+        self.size = min(max(self.size, self.minimum), self.maximum)
+
+    def overrun(self):
+        '''
+        Shrink the window after an error or a lost response.
+        '''
+        self.overruns += 1
+        self.slow_start = False
+        self.size = max(self.size / 2.0, self.minimum)
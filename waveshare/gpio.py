@@ -0,0 +1,401 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import time
+import queue
+import threading
+from datetime import timedelta
+
+from waveshare.lazy import LazyModule
+from waveshare.metrics import NULL_SINK
+
+GPIO = LazyModule("RPi.GPIO")
+gpiod = LazyModule("gpiod")
+
+###############################################################################
+# GPIO backends
+###############################################################################
+
+# A backend drives output pins, such as EPaper's reset and wakeup pins, with
+# setup_outputs(pins) and pulse(pin), hands them back with release(pins), and
+# watches input pins for InputService with watch().  Pins set up together
+# are done at once where the backend can.
+
+# Which edges of an input to watch for.
+FALLING = "falling"
+RISING = "rising"
+BOTH = "both"
+
+# RPi.GPIO.BOARD, so that it needn't be imported to be the default mode.
+BOARD = 10
+
+
+class RPiGPIOBackend(object):
+    '''
+    Pins through the RPi.GPIO module, which calls back on a thread of its
+    own for each edge.  Pins are numbered the way mode says, the board's
+    pin numbers by default, and mode=None leaves it as it was set.
+    waveshare.mockgpio can stand in for RPi.GPIO.
+    '''
+    def __init__(self, mode=BOARD):
+        if mode:
+            GPIO.setmode(mode)
+        self.pins = []
+
+    def setup_outputs(self, pins):
+        for pin in pins:
+            GPIO.setup(pin, GPIO.OUT)
+
+    def pulse(self, pin):
+        '''
+        Set the pin high and then low, returning how many seconds it was
+        high for.
+        '''
+        GPIO.output(pin, GPIO.HIGH)
+        start = time.perf_counter()
+        GPIO.output(pin, GPIO.LOW)
+        return time.perf_counter() - start
+
+    def release(self, pins):
+        GPIO.cleanup(list(pins))
+
+    def watch(self, pin, edge, pull_up, callback):
+        '''
+        Call callback(pin, rising, timestamp) for each edge on the pin, with
+        the time.monotonic() it was seen at.
+        '''
+        GPIO.setup(pin, GPIO.IN,
+                   pull_up_down=GPIO.PUD_UP if pull_up else GPIO.PUD_DOWN)
+        detect = {FALLING: GPIO.FALLING, RISING: GPIO.RISING,
+                  BOTH: GPIO.BOTH}[edge]
+
+        def edge_detected(channel):
+            timestamp = time.monotonic()
+            if edge == BOTH:
+                rising = GPIO.input(channel) == GPIO.HIGH
+            else:
+                rising = edge == RISING
+            callback(channel, rising, timestamp)
+
+        GPIO.add_event_detect(pin, detect, callback=edge_detected)
+        self.pins.append(pin)
+
+    def close(self):
+        for pin in self.pins:
+            GPIO.remove_event_detect(pin)
+        self.release(self.pins)
+        self.pins = []
+
+
+class GpiodBackend(object):
+    '''
+    Pins through a Linux GPIO character device such as /dev/gpiochip0,
+    with version 2 of the gpiod module from libgpiod.  Pins are the chip's
+    line offsets, which on a Pi are the BCM numbers rather than the board's
+    pin numbers.
+
+    Outputs set up together are requested together.  Edges are read on a
+    thread of this backend's own, and carry the time the kernel saw them at,
+    so time spent waiting on the interpreter is counted in the latency.
+    '''
+    def __init__(self, chip="/dev/gpiochip0", consumer="waveshare"):
+        self.chip = chip
+        self.consumer = consumer
+        self.requests = []
+        self.stopped = threading.Event()
+        self.threads = []
+        # the request each output pin belongs to
+        self.outputs = {}
+
+    def setup_outputs(self, pins):
+        settings = gpiod.LineSettings(direction=gpiod.line.Direction.OUTPUT,
+                                      output_value=gpiod.line.Value.INACTIVE)
+        request = gpiod.request_lines(self.chip, consumer=self.consumer,
+                                      config={tuple(pins): settings})
+        for pin in pins:
+            self.outputs[pin] = request
+
+    def pulse(self, pin):
+        '''
+        Set the pin high and then low, returning how many seconds it was
+        high for.
+        '''
+        request = self.outputs[pin]
+        request.set_value(pin, gpiod.line.Value.ACTIVE)
+        start = time.perf_counter()
+        request.set_value(pin, gpiod.line.Value.INACTIVE)
+        return time.perf_counter() - start
+
+    def release(self, pins):
+        requests = {self.outputs.pop(pin) for pin in pins
+                    if pin in self.outputs}
+        for request in requests:
+            if request not in self.outputs.values():
+                request.release()
+
+    def watch(self, pin, edge, pull_up, callback):
+        '''
+        Call callback(pin, rising, timestamp) for each edge on the pin, with
+        the time.monotonic() it was seen at.
+        '''
+        detect = {FALLING: gpiod.line.Edge.FALLING,
+                  RISING: gpiod.line.Edge.RISING,
+                  BOTH: gpiod.line.Edge.BOTH}[edge]
+        bias = (gpiod.line.Bias.PULL_UP if pull_up else
+                gpiod.line.Bias.PULL_DOWN)
+        settings = gpiod.LineSettings(edge_detection=detect, bias=bias)
+        request = gpiod.request_lines(self.chip, consumer=self.consumer,
+                                      config={pin: settings})
+        self.requests.append(request)
+        thread = threading.Thread(target=self._read, daemon=True,
+                                  args=(request, callback))
+        self.threads.append(thread)
+        thread.start()
+
+    def _read(self, request, callback):
+        rising_edge = gpiod.EdgeEvent.Type.RISING_EDGE
+        while not self.stopped.is_set():
+            if not request.wait_edge_events(timedelta(seconds=0.1)):
+                continue
+            for event in request.read_edge_events():
+                # the kernel stamps events with the monotonic clock
+                callback(event.line_offset, event.event_type == rising_edge,
+                         event.timestamp_ns / 1e9)
+
+    def close(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        for request in self.requests:
+            request.release()
+        self.requests = []
+        self.threads = []
+        self.release(list(self.outputs))
+
+
+class MockBackend(object):
+    '''
+    Pins kept in memory, for running without any GPIO at all.  Input edges
+    are made with drive() or press(), which call back on the caller's
+    thread the way the other backends call back on theirs.
+
+    Every output change is kept in history as (pin, level, time) for
+    looking at pulse timing, and can be watched with add_output_listener()
+    the same as with waveshare.mockgpio, such as by the simulator:
+
+        gpio = MockBackend()
+        simulator.attach_gpio(gpio)
+        paper = EPaper(port=simulator.port, gpio=gpio)
+    '''
+    def __init__(self):
+        self.levels = {}
+        self.watches = {}
+        self.outputs = set()
+        self.history = []
+        self.output_listeners = {}
+
+    def setup_outputs(self, pins):
+        for pin in pins:
+            self.outputs.add(pin)
+            self.levels[pin] = False
+
+    def pulse(self, pin):
+        self._output(pin, True)
+        start = time.perf_counter()
+        self._output(pin, False)
+        return time.perf_counter() - start
+
+    def _output(self, pin, level):
+        if pin not in self.outputs:
+            raise ValueError("pin %s isn't set up as an output" % pin)
+        self.levels[pin] = level
+        self.history.append((pin, level, time.monotonic()))
+        for listener in self.output_listeners.get(pin, []):
+            listener(pin, level)
+
+    def add_output_listener(self, pin, listener):
+        '''
+        Call listener(pin, level) whenever the output pin is set.
+        '''
+        self.output_listeners.setdefault(pin, []).append(listener)
+
+    def release(self, pins):
+        for pin in pins:
+            self.outputs.discard(pin)
+
+    def watch(self, pin, edge, pull_up, callback):
+        self.levels[pin] = pull_up
+        self.watches[pin] = (edge, callback)
+
+    def drive(self, pin, level, timestamp=None):
+        '''
+        Set the input to level, calling back if that is an edge being
+        watched for.
+        '''
+        level = bool(level)
+        old = self.levels.get(pin, False)
+        self.levels[pin] = level
+        if pin not in self.watches or old == level:
+            return
+        edge, callback = self.watches[pin]
+        if edge == BOTH or (edge == RISING) == level:
+            callback(pin, level, timestamp or time.monotonic())
+
+    def press(self, pin, bounces=0):
+        '''
+        Press and release a button wired to pull the pin low, with a number
+        of bounces of its contacts on the way down.
+        '''
+        for _ in range(bounces):
+            self.drive(pin, False)
+            self.drive(pin, True)
+        self.drive(pin, False)
+        self.drive(pin, True)
+
+    def close(self):
+        self.watches = {}
+
+###############################################################################
+# GPIO input
+###############################################################################
+
+# Edges on a pin closer together than this are contact bounce, in seconds.
+DEFAULT_DEBOUNCE = 0.05
+
+
+class InputService(object):
+    '''
+    Takes edges from a backend, debounces them and hands them to handlers
+    away from the backend's thread, so that nothing a handler does can hold
+    up or lose later edges:
+
+        inputs = InputService(RPiGPIOBackend())
+        inputs.add_button(11, lambda pin: queue.submit(SELECTIONS[0]))
+        inputs.run()
+
+    Handlers are called as handler(pin) for buttons, or handler(pin,
+    rising) for add_input(), one at a time and in the order the edges came
+    in.  By default that is on whichever thread calls run(), or start()'s
+    own.  Given schedule, such as loop.call_soon_threadsafe for asyncio or
+    reactor.callFromThread for twisted, they are called on that event loop
+    instead.  Either way, handlers shouldn't wait on the display themselves,
+    but hand the work to something like lib.renderqueue.RenderQueue.
+
+    The time from the backend seeing an edge to its handler being called is
+    reported as the gpio.edge_to_handler timing, and edges dropped as bounce
+    as the gpio.bounced count.
+    '''
+    def __init__(self, backend, debounce=DEFAULT_DEBOUNCE, metrics=None,
+                 schedule=None):
+        '''
+        @param backend Where the edges come from, such as RPiGPIOBackend.
+        @param debounce Edges on a pin closer together than this many
+                        seconds after one that was taken are ignored.
+        @param metrics The sink from waveshare.metrics to report to.
+        @param schedule Called with a function to have an event loop call
+                        it, rather than queuing edges for run().
+        '''
+        self.backend = backend
+        self.debounce = debounce
+        self.metrics = metrics or NULL_SINK
+        self.schedule = schedule
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.handlers = {}
+        self.last_edge = {}
+        self.thread = None
+        self.edges = 0
+        self.bounced = 0
+        self.handled = 0
+        self.max_latency = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def add_input(self, pin, handler, edge=BOTH, pull_up=True):
+        '''
+        Call handler(pin, rising) for each debounced edge on the pin.
+        '''
+        self.handlers[pin] = handler
+        self.backend.watch(pin, edge, pull_up, self._edge)
+
+    def add_button(self, pin, handler, pull_up=True):
+        '''
+        Call handler(pin) each time a button on the pin is pressed, wired to
+        pull it low if pull_up, or high otherwise.
+        '''
+        self.add_input(pin, lambda pin, rising: handler(pin),
+                       edge=FALLING if pull_up else RISING, pull_up=pull_up)
+
+    def _edge(self, pin, rising, timestamp):
+        # called on the backend's thread, which mustn't be kept waiting
+        with self.lock:
+            self.edges += 1
+            last = self.last_edge.get(pin)
+            if last is not None and timestamp - last < self.debounce:
+                self.bounced += 1
+                bounced = True
+            else:
+                self.last_edge[pin] = timestamp
+                bounced = False
+        if bounced:
+            self.metrics.count("gpio.bounced")
+            return
+        if self.schedule:
+            self.schedule(self._handle, pin, rising, timestamp)
+        else:
+            self.queue.put((pin, rising, timestamp))
+
+    def _handle(self, pin, rising, timestamp):
+        latency = time.monotonic() - timestamp
+        with self.lock:
+            self.handled += 1
+            self.max_latency = max(self.max_latency, latency)
+        self.metrics.timing("gpio.edge_to_handler", latency)
+        try:
+            self.handlers[pin](pin, rising)
+        except Exception as e:
+            print("handler for pin %s failed: %s" % (pin, e))
+
+    def run(self):
+        '''
+        Call the handlers for edges as they come in, until stop().
+        '''
+        while True:
+            edge = self.queue.get()
+            if edge is None:
+                return
+            self._handle(*edge)
+
+    def start(self):
+        '''
+        run() on a thread of its own.
+        '''
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.queue.put(None)
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def stats(self):
+        with self.lock:
+            return {'edges':       self.edges,
+                    'bounced':     self.bounced,
+                    'handled':     self.handled,
+                    'waiting':     self.queue.qsize(),
+                    'max_latency': self.max_latency}
+
+    def close(self):
+        '''
+        Stop and release the pins.
+        '''
+        self.stop()
+        self.backend.close()
@@ -0,0 +1,37 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import importlib
+
+###############################################################################
+# Deferred imports
+###############################################################################
+
+
+class LazyModule(object):
+    '''
+    Stands in for a module that is slow to import and not always needed,
+    such as serial when only replaying to a simulator, and imports it the
+    first time one of its attributes is used:
+
+        serial = LazyModule("serial")
+        ...
+        port = serial.Serial(path)      # imported here
+
+    waveshare.mockgpio.install() works the same as with a plain import, as
+    long as it is called before the module is first used.
+    '''
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        # only called for what this object doesn't have itself
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return "<lazy module %r%s>" % (
+            self._name, "" if self._module is None else " (imported)")
@@ -0,0 +1,278 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import time
+import threading
+
+###############################################################################
+# Metrics sinks
+###############################################################################
+
+class NullSink(object):
+    '''
+    Where EPaper and InvoiceDisplay report what they are doing.  This one
+    throws everything away, subclasses keep it somewhere.
+
+    Callers on hot paths check `enabled` first so that nothing at all is
+    done for them when metrics aren't wanted.
+    '''
+    enabled = False
+
+    def command(self, name, length):
+        '''
+        A command of the named type and encoded length was sent.
+        '''
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def gauge(self, name, value):
+        '''
+        The named level, such as a queue depth, is now at value.
+        '''
+        pass
+
+    def timing(self, name, seconds, start=None):
+        pass
+
+    def span(self, name):
+        '''
+        Returns a context manager that reports how long the with clause
+        took as a timing.
+        '''
+        return NULL_SPAN
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+NULL_SPAN = NullSpan()
+NULL_SINK = NullSink()
+
+
+class Span(object):
+    __slots__ = ['sink', 'name', 'start']
+
+    def __init__(self, sink, name):
+        self.sink = sink
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.sink.timing(self.name, time.perf_counter() - self.start,
+                         start=self.start)
+
+
+class Histogram(object):
+    '''
+    Counts timings in buckets that double in size, from 1 microsecond up.
+    '''
+    SMALLEST = 1e-6
+    BUCKETS = 32
+
+    def __init__(self):
+        self.buckets = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        bucket = 0
+        limit = self.SMALLEST
+        while seconds > limit and bucket < self.BUCKETS - 1:
+            bucket += 1
+            limit *= 2
+        self.buckets[bucket] += 1
+
+    def percentile(self, fraction):
+        '''
+        The upper bound of the bucket the given fraction of timings fall in.
+        '''
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bucket, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return min(self.SMALLEST * (2 ** bucket), self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'total': self.total,
+                'min':   self.min,
+                'max':   self.max,
+                'mean':  self.total / self.count if self.count else None,
+                'p50':   self.percentile(0.5),
+                'p90':   self.percentile(0.9),
+                'p99':   self.percentile(0.99)}
+
+
+class StatsSink(NullSink):
+    '''
+    Keeps counts, bytes per command type and a histogram per timing, to be
+    looked at with snapshot() or report().
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}
+        self.command_bytes = {}
+        self.counts = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def command(self, name, length):
+        with self.lock:
+            self.commands[name] = self.commands.get(name, 0) + 1
+            self.command_bytes[name] = (self.command_bytes.get(name, 0) +
+                                        length)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def gauge(self, name, value):
+        # the latest value and the highest seen
+        with self.lock:
+            highest = self.gauges.get(name, (value, value))[1]
+            self.gauges[name] = (value, max(value, highest))
+
+    def timing(self, name, seconds, start=None):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(seconds)
+
+    def span(self, name):
+        return Span(self, name)
+
+    def snapshot(self):
+        with self.lock:
+            return {'commands':      dict(self.commands),
+                    'command_bytes': dict(self.command_bytes),
+                    'counts':        dict(self.counts),
+                    'gauges':        {name: {'value': value, 'max': highest}
+                                      for name, (value, highest) in
+                                      self.gauges.items()},
+                    'timings':       {name: h.summary() for name, h in
+                                      self.histograms.items()}}
+
+    def report(self):
+        '''
+        Returns a human readable summary.
+        '''
+        snapshot = self.snapshot()
+        lines = []
+        for name in sorted(snapshot['commands']):
+            lines.append("%-40s %6d sent %8d bytes" % (
+                name, snapshot['commands'][name],
+                snapshot['command_bytes'][name]))
+        for name in sorted(snapshot['counts']):
+            lines.append("%-40s %6d" % (name, snapshot['counts'][name]))
+        for name in sorted(snapshot['gauges']):
+            g = snapshot['gauges'][name]
+            lines.append("%-40s %6s max %s" % (name, g['value'], g['max']))
+        for name in sorted(snapshot['timings']):
+            t = snapshot['timings'][name]
+            lines.append("%-40s %6d x mean %0.4f p90 %0.4f max %0.4f "
+                         "seconds" % (name, t['count'], t['mean'], t['p90'],
+                                      t['max']))
+        return "\n".join(lines)
+
+
+class PrintSink(NullSink):
+    '''
+    Prints timings to the console as they happen.
+    '''
+    enabled = True
+
+    def gauge(self, name, value):
+        print("%s: %s" % (name, value))
+
+    def timing(self, name, seconds, start=None):
+        print("%s: %0.2f seconds" % (name, seconds))
+
+    def span(self, name):
+        return Span(self, name)
+
+
+class TraceSink(NullSink):
+    '''
+    Records every span as an event that can be saved with chrome_trace() and
+    opened in chrome://tracing or Perfetto to see where the time goes.
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+
+    def timing(self, name, seconds, start=None):
+        if start is None:
+            start = time.perf_counter() - seconds
+        with self.lock:
+            self.events.append((name, start, seconds,
+                                threading.get_ident()))
+
+    def span(self, name):
+        return Span(self, name)
+
+    def chrome_trace(self):
+        with self.lock:
+            events = list(self.events)
+        return {'traceEvents': [{'name': name,
+                                 'ph':   'X',
+                                 'ts':   start * 1e6,
+                                 'dur':  seconds * 1e6,
+                                 'pid':  0,
+                                 'tid':  thread}
+                                for name, start, seconds, thread in events]}
+
+
+class MultiSink(NullSink):
+    '''
+    Passes everything on to several sinks.
+    '''
+    enabled = True
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def command(self, name, length):
+        for sink in self.sinks:
+            sink.command(name, length)
+
+    def count(self, name, value=1):
+        for sink in self.sinks:
+            sink.count(name, value)
+
+    def gauge(self, name, value):
+        for sink in self.sinks:
+            sink.gauge(name, value)
+
+    def timing(self, name, seconds, start=None):
+        for sink in self.sinks:
+            sink.timing(name, seconds, start=start)
+
+    def span(self, name):
+        return Span(self, name)
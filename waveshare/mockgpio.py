@@ -0,0 +1,143 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+'''
+A stand-in for the RPi.GPIO module for running off of a Raspberry Pi, such
+as against the simulator in waveshare.simulator.  It keeps the pin state in
+memory, lets outputs be watched and inputs be driven.
+
+Call install() before anything imports RPi.GPIO so that they get this module
+instead:
+
+    from waveshare import mockgpio
+    mockgpio.install()
+    from waveshare.epaper import EPaper
+'''
+
+import sys
+import types
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+mode = None
+directions = {}
+levels = {}
+event_callbacks = {}
+output_listeners = {}
+
+
+def install():
+    '''
+    Register this module as RPi.GPIO.
+    '''
+    package = sys.modules.get('RPi')
+    if package is None:
+        package = types.ModuleType('RPi')
+        package.__path__ = []
+        sys.modules['RPi'] = package
+    package.GPIO = sys.modules[__name__]
+    sys.modules['RPi.GPIO'] = sys.modules[__name__]
+
+
+def setmode(new_mode):
+    global mode
+    mode = new_mode
+
+
+def getmode():
+    return mode
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=None):
+    directions[channel] = direction
+    if direction == IN:
+        levels[channel] = LOW if pull_up_down == PUD_DOWN else HIGH
+    else:
+        levels[channel] = initial if initial is not None else LOW
+
+
+def output(channel, value):
+    value = HIGH if value else LOW
+    levels[channel] = value
+    for listener in output_listeners.get(channel, []):
+        listener(channel, value)
+
+
+def input(channel):
+    return levels.get(channel, LOW)
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    event_callbacks[channel] = (edge, [callback] if callback else [])
+
+
+def add_event_callback(channel, callback):
+    event_callbacks[channel][1].append(callback)
+
+
+def remove_event_detect(channel):
+    event_callbacks.pop(channel, None)
+
+
+def cleanup(channel=None):
+    if channel is None:
+        channels = list(directions)
+    elif isinstance(channel, (list, tuple)):
+        channels = channel
+    else:
+        channels = [channel]
+    for c in channels:
+        directions.pop(c, None)
+        levels.pop(c, None)
+        event_callbacks.pop(c, None)
+
+
+###############################################################################
+# hooks for tests and simulators
+###############################################################################
+
+def add_output_listener(channel, listener):
+    '''
+    Call listener(channel, value) whenever the output channel is set.
+    '''
+    output_listeners.setdefault(channel, []).append(listener)
+
+
+def drive(channel, value):
+    '''
+    Drive an input channel to the value, calling the event detection
+    callbacks if that makes an edge they are looking for.
+    '''
+    value = HIGH if value else LOW
+    old = levels.get(channel, LOW)
+    levels[channel] = value
+    if channel not in event_callbacks or old == value:
+        return
+    edge, callbacks = event_callbacks[channel]
+    if edge == BOTH or (edge == RISING) == (value == HIGH):
+        for callback in callbacks:
+            callback(channel)
+
+
+def press(channel):
+    '''
+    Press and release a button wired to pull the channel low.
+    '''
+    drive(channel, LOW)
+    drive(channel, HIGH)
@@ -0,0 +1,154 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+from waveshare.epaper import EPaper
+from waveshare.gpio import BOARD
+from waveshare.gpio import RPiGPIOBackend
+from waveshare.metrics import NULL_SINK
+
+###############################################################################
+# Several panels at once
+###############################################################################
+
+# How long to wait for the responses to a program sent to a panel.
+PROGRAM_TIMEOUT = 10
+
+
+def send_program(paper, program, timeout=PROGRAM_TIMEOUT):
+    '''
+    Send the program and wait for its responses, raising the first error
+    the panel reports or TimeoutError if they don't all come back.
+    '''
+    future = paper.send_program(program)
+    paper.read_responses(timeout=timeout)
+    return future.result(timeout=0)
+
+
+class Panel(object):
+    '''
+    One of the panels of a PanelManager, with a thread of its own that
+    everything done with it runs on in turn.
+    '''
+    def __init__(self, index, port, reset, wakeup):
+        self.index = index
+        self.port = port
+        self.reset = reset
+        self.wakeup = wakeup
+        self.paper = None
+        self.error = None
+        self.failures = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="panel-%d" % index)
+
+
+class PanelManager(object):
+    '''
+    Drives a bank of modules on their own serial ports and reset and wakeup
+    pins at the same time, each from its own thread.  Serial writes and
+    reads don't hold the interpreter lock, so the panels keep each other
+    waiting very little and a draw on all of them takes about as long as on
+    one.
+
+    What is to be drawn is given as a waveshare.program.Program, which is
+    encoded once however many panels it is sent to:
+
+        with PanelManager([("/dev/ttyAMA0", 3, 7),
+                           ("/dev/ttyUSB0", 29, 31)]) as panels:
+            program = compile_selection(selection)
+            for future in panels.broadcast(program):
+                ...
+
+    Failures stay with the panel they happen on.  A panel that couldn't be
+    opened, or whose draw fails, fails its own futures and leaves the
+    others drawing.
+    '''
+    def __init__(self, panels, mode=BOARD, metrics=None,
+                 paper_class=EPaper, gpio=None):
+        '''
+        @param panels A (port, reset pin, wakeup pin) for each panel.
+        @param mode The mode of GPIO pin addressing, set once for all.
+        @param metrics The sink from waveshare.metrics given to every panel.
+        @param paper_class What to open each panel with.
+        @param gpio The waveshare.gpio backend all the pins are driven
+                    through, an RPiGPIOBackend in mode if None.
+        '''
+        self.metrics = metrics or NULL_SINK
+        self.gpio = gpio or RPiGPIOBackend(mode)
+        self.panels = [Panel(index, port, reset, wakeup)
+                       for index, (port, reset, wakeup) in enumerate(panels)]
+        for panel in self.panels:
+            try:
+                panel.paper = paper_class(port=panel.port, reset=panel.reset,
+                                          wakeup=panel.wakeup, mode=None,
+                                          metrics=self.metrics,
+                                          gpio=self.gpio)
+            except Exception as e:
+                print("couldn't open panel %d on %s: %s" % (panel.index,
+                                                           panel.port, e))
+                panel.error = e
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.panels)
+
+    def submit(self, index, fn, *args):
+        '''
+        Run fn(paper, *args) on the panel's thread, after anything submitted
+        to it before.  Returns a concurrent.futures.Future of the result.
+        '''
+        panel = self.panels[index]
+        if panel.paper is None:
+            future = Future()
+            future.set_exception(panel.error)
+            return future
+        return panel.executor.submit(self._run, panel, fn, *args)
+
+    def submit_all(self, fn, *args, indices=None):
+        '''
+        submit() to every panel, or the ones in indices.  Returns a list of
+        the futures.
+        '''
+        if indices is None:
+            indices = range(len(self.panels))
+        return [self.submit(index, fn, *args) for index in indices]
+
+    def draw(self, index, program):
+        '''
+        Send a program to one panel.
+        '''
+        return self.submit(index, send_program, program)
+
+    def broadcast(self, program, indices=None):
+        '''
+        Send the same program to every panel, or the ones in indices.
+        '''
+        return self.submit_all(send_program, program, indices=indices)
+
+    def _run(self, panel, fn, *args):
+        try:
+            with self.metrics.span("panels.%d.run" % panel.index):
+                return fn(panel.paper, *args)
+        except Exception:
+            panel.failures += 1
+            self.metrics.count("panels.%d.failed" % panel.index)
+            raise
+
+    def close(self):
+        '''
+        Wait for what was submitted to finish and close every panel.
+        '''
+        for panel in self.panels:
+            panel.executor.shutdown(wait=True)
+            if panel.paper is not None:
+                panel.paper.close()
+                panel.paper = None
+                panel.error = ValueError("panel %d is closed" % panel.index)
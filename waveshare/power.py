@@ -0,0 +1,188 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import time
+import threading
+from contextlib import contextmanager
+
+from waveshare.metrics import NULL_SINK
+
+###############################################################################
+# Power management
+###############################################################################
+
+# How long the module may be idle before it is put to sleep, in seconds.
+DEFAULT_IDLE = 60
+# How long to wait for the module to answer a handshake once woken, and how
+# often the timer checks back while it is waking.
+WAKE_POLL = 0.2
+WAKE_TIMEOUT = 5
+
+
+class PowerManager(object):
+    '''
+    Puts an EPaper to sleep once it has been idle for a while and wakes it
+    back up when it is needed.
+
+    Waking takes a while, so it is started as early as possible with wake(),
+    such as on the first edge of a button press, and goes on in the
+    background.  Drawing happens inside hold(), which keeps the module from
+    being put to sleep and wakes it if nobody did, and wait_ready() is
+    called just before the first command is sent, so the wake up overlaps
+    with making the QR code:
+
+        power.wake()                    # button went down
+        with power.hold():
+            qr = QRDraw(invoice)
+            power.wait_ready()
+            ...
+
+    InvoiceDisplay does the last part itself when given one.
+
+    The time from wake() until the module answers a handshake is reported
+    as the power.wake_to_ready timing, and the part of it that a draw ended
+    up waiting on as power.wait_ready, to tune the idle period by.  A module
+    that doesn't answer is counted as power.wake_failed and taken to still
+    be asleep, so the next wake() tries again.
+    '''
+    def __init__(self, paper, idle=DEFAULT_IDLE, metrics=None):
+        '''
+        @param paper The EPaper to manage.
+        @param idle How long the module may be idle before it is put to
+                    sleep, in seconds.
+        @param metrics The sink from waveshare.metrics to report to, the
+                       same as the paper's if None.
+        '''
+        self.paper = paper
+        self.idle = idle
+        self.metrics = metrics or getattr(paper, 'metrics', NULL_SINK)
+        self.condition = threading.Condition()
+        self.asleep = False
+        self.awake = threading.Event()
+        self.awake.set()
+        # whether the module is being put to sleep, and whether wake() was
+        # called meanwhile, to be done once it has been
+        self.sleeping = False
+        self.wake_queued = False
+        self.waking = None
+        self.holds = 0
+        self.last_used = time.monotonic()
+        self.stopped = False
+        self.sleeps = 0
+        self.wakes = 0
+        self.timer = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.timer.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.timer.join()
+        if self.waking:
+            self.waking.join()
+
+    def wake(self):
+        '''
+        Start waking the module up if it is asleep, without waiting for it.
+        This never waits on the serial port, so it can be called from a GPIO
+        callback.
+        '''
+        with self.condition:
+            self.last_used = time.monotonic()
+            if not self.asleep:
+                return
+            self.asleep = False
+            self.wakes += 1
+            if self.sleeping:
+                # woken as soon as it has been put to sleep
+                self.wake_queued = True
+            else:
+                self._start_wake()
+            self.condition.notify()
+
+    def _start_wake(self):
+        self.waking = threading.Thread(target=self._wake, daemon=True)
+        self.waking.start()
+
+    def wait_ready(self, timeout=WAKE_TIMEOUT):
+        '''
+        Wait for the module to be awake and answering.  Returns False if it
+        didn't answer within timeout seconds, in which case it mustn't be
+        drawn on, the thread waking it may still be using it.
+        '''
+        if self.awake.is_set():
+            return True
+        with self.metrics.span("power.wait_ready"):
+            return self.awake.wait(timeout)
+
+    @contextmanager
+    def hold(self):
+        '''
+        Keep the module awake for the with clause, waking it if need be.
+        '''
+        with self.condition:
+            self.holds += 1
+        self.wake()
+        try:
+            yield self
+        finally:
+            with self.condition:
+                self.holds -= 1
+                self.last_used = time.monotonic()
+                self.condition.notify()
+
+    def _run(self):
+        with self.condition:
+            while not self.stopped:
+                if self.asleep or self.holds:
+                    self.condition.wait()
+                    continue
+                idle = time.monotonic() - self.last_used
+                if idle < self.idle:
+                    self.condition.wait(self.idle - idle)
+                    continue
+                if self.waking and self.waking.is_alive():
+                    self.condition.wait(WAKE_POLL)
+                    continue
+                self._sleep()
+
+    def _sleep(self):
+        # decided on with the condition held, so that a draw can't start
+        # once the module is going to sleep, but done without it, so that
+        # wake() and hold() don't wait on the serial port meanwhile
+        self.asleep = True
+        self.sleeping = True
+        self.awake.clear()
+        self.condition.release()
+        try:
+            self.paper.read_responses()
+            self.paper.sleep()
+        except Exception as e:
+            print("couldn't put the module to sleep: %s" % e)
+        finally:
+            self.condition.acquire()
+        self.sleeping = False
+        self.sleeps += 1
+        self.metrics.count("power.sleep")
+        if self.wake_queued:
+            self.wake_queued = False
+            self._start_wake()
+
+    def _wake(self):
+        start = time.monotonic()
+        try:
+            self.paper.wake()
+            self.paper.wait_ready(timeout=WAKE_TIMEOUT)
+        except Exception as e:
+            print("module didn't come back after waking it: %s" % e)
+            self.metrics.count("power.wake_failed")
+            with self.condition:
+                self.asleep = True
+                self.condition.notify()
+            return
+        self.metrics.timing("power.wake_to_ready", time.monotonic() - start)
+        self.awake.set()
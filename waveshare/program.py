@@ -0,0 +1,184 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import os
+import mmap
+import struct
+from array import array
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from waveshare.epaper import Handshake
+from waveshare.epaper import SetBaudrate
+from waveshare.epaper import ReadBaudrate
+from waveshare.epaper import ReadStorageMode
+from waveshare.epaper import SetStorageMode
+from waveshare.epaper import SleepMode
+from waveshare.epaper import RefreshAndUpdate
+from waveshare.epaper import CurrentDisplayRotation
+from waveshare.epaper import SetCurrentDisplayRotation
+from waveshare.epaper import ImportFontLibrary
+from waveshare.epaper import ImportImage
+from waveshare.epaper import SetPallet
+from waveshare.epaper import GetPallet
+from waveshare.epaper import SetEnFontSize
+from waveshare.epaper import SetZhFontSize
+from waveshare.epaper import DisplayText
+from waveshare.epaper import DisplayImage
+from waveshare.epaper import DrawCircle
+from waveshare.epaper import FillCircle
+from waveshare.epaper import DrawTriangle
+from waveshare.epaper import FillTriangle
+from waveshare.epaper import DrawRectangle
+from waveshare.epaper import FillRectangle
+from waveshare.epaper import ClearScreen
+
+###############################################################################
+# Programs of encoded packets
+###############################################################################
+
+# The command class for each command byte, which is what the response to a
+# packet in a program is expected to be like.
+COMMAND_CLASSES = {cls.COMMAND[0]: cls for cls in [
+    Handshake, SetBaudrate, ReadBaudrate, ReadStorageMode, SetStorageMode,
+    SleepMode, RefreshAndUpdate, CurrentDisplayRotation,
+    SetCurrentDisplayRotation, ImportFontLibrary, ImportImage, SetPallet,
+    GetPallet, SetEnFontSize, SetZhFontSize, DisplayText, DisplayImage,
+    DrawCircle, FillCircle, DrawTriangle, FillTriangle, DrawRectangle,
+    FillRectangle, ClearScreen]}
+
+# The offset of the command byte in a packet, after the header and length.
+COMMAND_OFFSET = 3
+
+# A program file is this header, then count + 1 packet offsets into the data
+# as native 32 bit unsigned ints (the files are only meant for the machine
+# that wrote them), then the data.
+MAGIC = b'EPPG'
+VERSION = 1
+HEADER = struct.Struct("=4sHHI")
+
+
+class Program(object):
+    '''
+    A run of encoded packets, ready to be written to the device as they are
+    with EPaper.send_program(), and an index of where each one starts.
+
+    Programs are saved to files with save() and opened with load(), which
+    maps the file into memory instead of reading it.
+    '''
+    def __init__(self, data, offsets, mapped=None):
+        '''
+        @param data The packets, as bytes or anything else that can be
+                    sliced with a memoryview.
+        @param offsets The start of each packet in the data, plus the end of
+                       the last one.
+        @param mapped The mmap the data and offsets are in, if any, which is
+                      closed by close().
+        '''
+        self.data = memoryview(data)
+        self.offsets = offsets
+        self.mapped = mapped
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def command_class(self, index):
+        '''
+        The class of the command in the packet at index.
+        '''
+        return COMMAND_CLASSES[self.data[self.offsets[index] +
+                                         COMMAND_OFFSET]]
+
+    def close(self):
+        if self.mapped is None:
+            return
+        self.data.release()
+        self.offsets.release()
+        self.mapped.close()
+        self.mapped = None
+
+    def save(self, path):
+        '''
+        Write the program to a file, replacing whatever is there all at once.
+        '''
+        offsets = array('I', self.offsets)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, len(self)))
+            f.write(offsets.tobytes())
+            f.write(self.data)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Map a program saved with save() into memory.  Raises ValueError if
+        the file isn't one, or is of another version.
+        '''
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(mapped) < HEADER.size:
+                raise ValueError("%s is too short to be a program" % path)
+            magic, version, _, count = HEADER.unpack_from(mapped)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("%s isn't a version %d program" %
+                                 (path, VERSION))
+            start = HEADER.size + (4 * (count + 1))
+            if len(mapped) < start:
+                # the offsets couldn't even be read
+                raise ValueError("%s is truncated" % path)
+            view = memoryview(mapped)
+            offsets = view[HEADER.size:start].cast('I')
+            data = view[start:]
+            view.release()
+            if len(offsets) != count + 1 or offsets[-1] != len(data):
+                offsets.release()
+                data.release()
+                raise ValueError("%s is truncated" % path)
+            program = cls(data, offsets, mapped)
+            data.release()
+            return program
+        except Exception:
+            mapped.close()
+            raise
+
+
+class ProgramRecorder(object):
+    '''
+    Takes the place of an EPaper to record the packets of the commands sent
+    to it into a Program rather than sending them anywhere.
+    '''
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array('I', [0])
+
+    def send(self, command):
+        self.data.extend(command.encode())
+        self.offsets.append(len(self.data))
+        future = Future()
+        future.set_result(None)
+        return future
+
+    @contextmanager
+    def frame(self):
+        yield self
+
+    def flush(self):
+        pass
+
+    def read_responses(self, timeout=3):
+        pass
+
+    def program(self):
+        '''
+        Returns a Program of everything recorded so far.
+        '''
+        return Program(bytes(self.data), array('I', self.offsets))
@@ -0,0 +1,330 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import InvalidStateError
+
+###############################################################################
+# Response parsing
+###############################################################################
+
+def command_name(command):
+    '''
+    The name of a command's type, given the command or its class.
+    '''
+    return getattr(command, '__name__', type(command).__name__)
+
+
+class ResponseError(Exception):
+    '''
+    The device answered a command with an error rather than "OK".
+    '''
+    def __init__(self, command, response):
+        self.command = command
+        self.response = response
+        super().__init__("%s failed: %s" % (command_name(command), response))
+
+
+class ResponseParser(object):
+    '''
+    Matches the stream of bytes that comes back from the device to the
+    commands that were sent, in the order they were sent.
+
+    Each command that expects a response is registered along with a future
+    (anything with set_result() and set_exception(), such as a
+    concurrent.futures.Future or an asyncio.Future) which is resolved with
+    the response bytes when it arrives, or failed with a ResponseError when
+    the device reports an error.
+
+    Listeners added with add_listener() are called for every response with
+    the command, the kind of response ('ok', 'value' or 'error'), the time
+    since the command was written out (None if that wasn't marked with
+    sent()) and the number of commands that were still waiting on responses.
+    '''
+    OK = b'OK'
+    ERROR = b'Error'
+    ERROR_CODE = b':0123456789'
+    VALUE = b'0123456789'
+
+    def __init__(self):
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.bytes_expected = 0
+        self.unexpected = 0
+        # how many commands have been registered with expect() so far
+        self.registered = 0
+        self.listeners = []
+        self.lock = threading.Lock()
+        # notified whenever commands stop waiting on responses
+        self.changed = threading.Condition(self.lock)
+
+    @property
+    def in_flight(self):
+        '''
+        The number of commands waiting on a response.
+        '''
+        return len(self.pending)
+
+    @property
+    def buffered(self):
+        '''
+        The number of bytes read that aren't a complete response yet, such
+        as an error code that more digits may still be coming for.
+        '''
+        return len(self.buffer)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def wait(self, in_flight, timeout):
+        '''
+        Wait for up to timeout seconds for fewer than in_flight commands to
+        be waiting on responses, as they are fed in by another thread.
+        Returns True if there are.
+        '''
+        with self.changed:
+            return self.changed.wait_for(
+                lambda: len(self.pending) < in_flight, timeout)
+
+    def expect(self, command, future):
+        '''
+        Registers the future to be resolved by the response to the command.
+        Commands that have no response resolve straight away. Returns the
+        future.
+        '''
+        if command.RESPONSE_BYTES == 0:
+            future.set_result(None)
+            return future
+        with self.lock:
+            self.pending.append([command, future, None])
+            self.bytes_expected += command.RESPONSE_BYTES
+            self.registered += 1
+        return future
+
+    def sent(self, registered=None):
+        '''
+        Marks the commands that were registered since the last call as
+        written out to the device, which is what response latency is
+        measured from.  Given the value registered had when the write was
+        made, commands registered after it are left unmarked, for writes
+        that go out some time later.
+        '''
+        now = time.monotonic()
+        with self.lock:
+            # the registration number of the newest pending command
+            number = self.registered - 1
+            for entry in reversed(self.pending):
+                if registered is not None and number >= registered:
+                    number -= 1
+                    continue
+                if entry[2] is not None:
+                    break
+                entry[2] = now
+                number -= 1
+
+    def oldest(self):
+        '''
+        Returns the command and future that are next in line for a response,
+        or None if nothing is waiting.
+        '''
+        with self.lock:
+            if not self.pending:
+                return None
+            command, future, sent = self.pending[0]
+            return command, future
+
+    def feed(self, data):
+        '''
+        Parses bytes read from the device, resolving the futures of any
+        commands whose responses are now complete.
+        '''
+        with self.lock:
+            self.buffer.extend(data)
+            resolved = self._parse(False)
+            if resolved:
+                self.changed.notify_all()
+        self._resolve(resolved)
+
+    def idle(self):
+        '''
+        To be called when the device has gone quiet. Completes a response
+        that was waiting to see if more of it would arrive.
+        '''
+        with self.lock:
+            if not self.buffer:
+                return
+            resolved = self._parse(True)
+            if resolved:
+                self.changed.notify_all()
+        self._resolve(resolved)
+
+    def fail(self, exception):
+        '''
+        Fails the futures of every command still waiting on a response.
+        '''
+        with self.lock:
+            pending = list(self.pending)
+            self.pending.clear()
+            self.buffer.clear()
+            self.bytes_expected = 0
+            self.changed.notify_all()
+        for command, future, sent in pending:
+            if not future.cancelled():
+                future.set_exception(exception)
+
+    def abandon(self, future, exception):
+        '''
+        Stops waiting on the response to the command registered with the
+        future, failing it, and leaves any others waiting.  Only do this with
+        the newest command, one answered after it would be taken for the
+        abandoned one's.
+        '''
+        with self.lock:
+            for entry in list(self.pending):
+                if entry[1] is future:
+                    self.pending.remove(entry)
+                    self.bytes_expected -= entry[0].RESPONSE_BYTES
+            self.changed.notify_all()
+        if not future.cancelled():
+            future.set_exception(exception)
+
+    def cancel(self):
+        '''
+        Cancels the futures of every command still waiting on a response.
+        '''
+        with self.lock:
+            pending = list(self.pending)
+            self.pending.clear()
+            self.buffer.clear()
+            self.bytes_expected = 0
+            self.changed.notify_all()
+        for command, future, sent in pending:
+            future.cancel()
+
+    def futures(self):
+        '''
+        Returns the futures of every command still waiting on a response.
+        '''
+        with self.lock:
+            return [future for command, future, sent in self.pending]
+
+    def _scan(self, final):
+        # Returns the length and kind of the token at the start of the
+        # buffer. A length of 0 means more bytes are needed to tell, a kind of
+        # None means the bytes are noise that don't belong to any response.
+        b = self.buffer
+        for token, kind in ((self.OK, 'ok'), (self.ERROR, 'error')):
+            n = min(len(token), len(b))
+            if b[:n] != token[:n]:
+                continue
+            if n < len(token):
+                return (len(b), None) if final else (0, None)
+            if kind == 'ok':
+                return n, kind
+            end = n
+            while end < len(b) and b[end] in self.ERROR_CODE:
+                end += 1
+            if end == len(b) and not final:
+                return 0, None
+            return end, kind
+        if self.pending and self.pending[0][0].RESPONSE_VALUE:
+            limit = self.pending[0][0].RESPONSE_BYTES
+            end = 0
+            while end < len(b) and end < limit and b[end] in self.VALUE:
+                end += 1
+            if end:
+                if end < limit and end == len(b) and not final:
+                    return 0, None
+                return end, 'value'
+        return 1, None
+
+    def _parse(self, final):
+        now = time.monotonic()
+        resolved = []
+        while self.buffer:
+            length, kind = self._scan(final)
+            if length == 0:
+                break
+            token = bytes(self.buffer[:length])
+            del self.buffer[:length]
+            if kind is None or not self.pending:
+                self.unexpected += length
+                continue
+            in_flight = len(self.pending)
+            command, future, sent = self.pending.popleft()
+            self.bytes_expected -= command.RESPONSE_BYTES
+            latency = now - sent if sent is not None else None
+            resolved.append((command, future, kind, token, latency,
+                             in_flight))
+        return resolved
+
+    def _resolve(self, resolved):
+        for command, future, kind, token, latency, in_flight in resolved:
+            for listener in self.listeners:
+                listener(command, kind, latency, in_flight)
+            if future.cancelled():
+                continue
+            if kind == 'error':
+                future.set_exception(ResponseError(command, token))
+            else:
+                future.set_result(token)
+
+
+class GroupFuture(Future):
+    '''
+    One future to be resolved by the responses to a group of commands, such
+    as all of the packets of a program.  It resolves with the last response
+    once they have all come back, or fails with the first error.
+    '''
+    def __init__(self, count):
+        super().__init__()
+        self.remaining = count
+        if count == 0:
+            super().set_result(ResponseParser.OK)
+
+    def set_result(self, result):
+        self.remaining -= 1
+        if self.remaining == 0 and not self.done():
+            super().set_result(result)
+
+    def set_exception(self, exception):
+        self.remaining -= 1
+        try:
+            super().set_exception(exception)
+        except InvalidStateError:
+            pass
+
+
+###############################################################################
+# Background reader
+###############################################################################
+
+class ResponseReader(threading.Thread):
+    '''
+    Reads from the serial device in the background and feeds everything it
+    gets to a ResponseParser, so that the futures of sent commands resolve
+    without the sender having to read.
+    '''
+    def __init__(self, serial, parser, interval=0.05):
+        super().__init__(daemon=True)
+        self.serial = serial
+        self.parser = parser
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        self.serial.timeout = self.interval
+        while not self.stopped.is_set():
+            b = self.serial.read(max(1, self.serial.in_waiting))
+            if b:
+                self.parser.feed(b)
+            else:
+                self.parser.idle()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,488 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import os
+import pty
+import select
+import tty
+import time
+import struct
+import termios
+import threading
+
+from waveshare.epaper import Command
+from waveshare.epaper import PIN_RESET
+from waveshare.epaper import PIN_WAKEUP
+from waveshare.epaper import DEFAULT_BAUDRATE
+
+###############################################################################
+# timing model
+###############################################################################
+
+class LatencyModel(object):
+    '''
+    How long the simulated module takes to do things, in seconds.
+
+    Bytes take per_byte each to arrive, or if that is None the time for 10
+    bits (start, 8 data and stop) at the baud rate in use.  Each command then
+    takes per_command to execute plus per_pixel for each pixel it paints,
+    and a refresh takes refresh on top of that.  For boot seconds after a
+    reset or wake up, commands are ignored.
+    '''
+    def __init__(self, per_byte=None, per_command=0.0005, per_pixel=0.0,
+                 refresh=1.5, boot=0.0):
+        self.per_byte = per_byte
+        self.per_command = per_command
+        self.per_pixel = per_pixel
+        self.refresh = refresh
+        self.boot = boot
+
+    def transfer(self, length, baudrate):
+        if self.per_byte is not None:
+            return length * self.per_byte
+        return length * 10.0 / baudrate
+
+    def execute(self, pixels, refresh=False):
+        return (self.per_command + (pixels * self.per_pixel) +
+                (self.refresh if refresh else 0.0))
+
+
+###############################################################################
+# frame buffer
+###############################################################################
+
+class Framebuffer(object):
+    '''
+    The module's 800x600 4 level gray frame buffer, a byte per pixel with the
+    same values as the SetPallet colors (0 black to 3 white).
+    '''
+    def __init__(self, width=800, height=600, color=3):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray([color]) * (width * height)
+
+    def get(self, x, y):
+        return self.pixels[y * self.width + x]
+
+    def fill(self, color):
+        self.pixels[:] = bytearray([color]) * len(self.pixels)
+
+    def span(self, y, x1, x2, color):
+        # paints x1 to x2 inclusive on row y, clipped, returns pixel count
+        if y < 0 or y >= self.height:
+            return 0
+        x1 = max(min(x1, x2), 0)
+        x2 = min(max(x1, x2), self.width - 1)
+        if x2 < x1:
+            return 0
+        row = y * self.width
+        self.pixels[row + x1:row + x2 + 1] = bytearray([color]) * (x2 - x1 + 1)
+        return x2 - x1 + 1
+
+    def point(self, x, y, color):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.pixels[y * self.width + x] = color
+            return 1
+        return 0
+
+    def fill_rectangle(self, x1, y1, x2, y2, color):
+        return sum(self.span(y, x1, x2, color)
+                   for y in range(min(y1, y2), max(y1, y2) + 1))
+
+    def draw_line(self, x1, y1, x2, y2, color):
+        # Bresenham
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        err = dx + dy
+        count = 0
+        while True:
+            count += self.point(x1, y1, color)
+            if x1 == x2 and y1 == y2:
+                return count
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x1 += sx
+            if e2 <= dx:
+                err += dx
+                y1 += sy
+
+    def draw_rectangle(self, x1, y1, x2, y2, color):
+        return (self.draw_line(x1, y1, x2, y1, color) +
+                self.draw_line(x2, y1, x2, y2, color) +
+                self.draw_line(x2, y2, x1, y2, color) +
+                self.draw_line(x1, y2, x1, y1, color))
+
+    def draw_circle(self, cx, cy, r, color):
+        count = 0
+        x = r
+        y = 0
+        err = 1 - r
+        while x >= y:
+            for px, py in [(x, y), (y, x), (-y, x), (-x, y),
+                           (-x, -y), (-y, -x), (y, -x), (x, -y)]:
+                count += self.point(cx + px, cy + py, color)
+            y += 1
+            if err < 0:
+                err += 2 * y + 1
+            else:
+                x -= 1
+                err += 2 * (y - x) + 1
+        return count
+
+    def fill_circle(self, cx, cy, r, color):
+        count = 0
+        for dy in range(-r, r + 1):
+            dx = int((r * r - dy * dy) ** 0.5)
+            count += self.span(cy + dy, cx - dx, cx + dx, color)
+        return count
+
+    def draw_triangle(self, x1, y1, x2, y2, x3, y3, color):
+        return (self.draw_line(x1, y1, x2, y2, color) +
+                self.draw_line(x2, y2, x3, y3, color) +
+                self.draw_line(x3, y3, x1, y1, color))
+
+    def fill_triangle(self, x1, y1, x2, y2, x3, y3, color):
+        count = 0
+        points = [(x1, y1), (x2, y2), (x3, y3)]
+        for y in range(min(y1, y2, y3), max(y1, y2, y3) + 1):
+            xs = []
+            for (ax, ay), (bx, by) in zip(points, points[1:] + points[:1]):
+                if ay == by:
+                    if ay == y:
+                        xs.extend([ax, bx])
+                elif min(ay, by) <= y <= max(ay, by):
+                    xs.append(ax + (y - ay) * (bx - ax) // (by - ay))
+            if xs:
+                count += self.span(y, min(xs), max(xs), color)
+        return count
+
+    def to_pgm(self):
+        '''
+        Returns the frame buffer as a binary PGM image, for looking at.
+        '''
+        header = b'P5 %d %d 3\n' % (self.width, self.height)
+        return header + bytes(self.pixels)
+
+
+###############################################################################
+# simulated module
+###############################################################################
+
+class Simulator(object):
+    '''
+    Acts as the 4.3inch e-Paper UART module on a pseudo-terminal, so EPaper
+    can be run without the hardware:
+
+        from waveshare import mockgpio
+        mockgpio.install()
+        from waveshare.epaper import EPaper
+        from waveshare.simulator import Simulator
+
+        simulator = Simulator()
+        simulator.attach_gpio(mockgpio)
+        simulator.start()
+        paper = EPaper(port=simulator.port)
+
+    It decodes the command frames and checks their checksums, answers the
+    way the module does and draws into an 800x600 4 level gray frame buffer,
+    which is copied to the screen on refresh.  Text is drawn as a filled
+    block per character since the module's fonts aren't available.
+
+    The time everything would have taken on the module is tracked in
+    modeled_time according to the latency model, taking the host to write
+    back to back except while a refresh is running.  With realtime set it also
+    waits that long before answering, so the host sees realistic latency.
+
+    The panel is 800x600, InvoiceDisplay lays things out for it mounted in
+    portrait, which is width=600 and height=800.
+    '''
+    WIDTH = 800
+    HEIGHT = 600
+    # The simulator's own error codes, the module's aren't documented.
+    ERROR_CHECKSUM = b'Error:1'
+    ERROR_COMMAND = b'Error:2'
+    ERROR_PARAMETER = b'Error:3'
+
+    def __init__(self, latency=None, realtime=False, width=WIDTH,
+                 height=HEIGHT):
+        self.latency = latency or LatencyModel()
+        self.realtime = realtime
+        self.width = width
+        self.height = height
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.thread = None
+        self.stopped = threading.Event()
+        self.buffer = bytearray()
+        self.booted_at = 0.0
+        self.reset()
+        self.commands = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.checksum_errors = 0
+        self.refreshes = 0
+        self.command_counts = {}
+
+    def reset(self):
+        '''
+        Put the module back to how it powers up.
+        '''
+        self.framebuffer = Framebuffer(self.width, self.height)
+        self.screen = Framebuffer(self.width, self.height)
+        self.foreground = 0
+        self.background = 3
+        self.en_font_size = 1
+        self.zh_font_size = 1
+        self.rotation = 0
+        self.storage_mode = 0
+        self.baudrate = DEFAULT_BAUDRATE
+        self.sleeping = False
+        self.wire_clock = 0.0
+        self.modeled_time = 0.0
+
+    def attach_gpio(self, gpio, reset=PIN_RESET, wakeup=PIN_WAKEUP):
+        '''
+        Watch the reset and wake up pins of a mock GPIO module such as
+        waveshare.mockgpio.
+        '''
+        gpio.add_output_listener(reset, self._reset_pin)
+        gpio.add_output_listener(wakeup, self._wakeup_pin)
+
+    def _reset_pin(self, channel, value):
+        if value:
+            self.buffer.clear()
+            self.reset()
+            self.booted_at = time.monotonic() + self.latency.boot
+
+    def _wakeup_pin(self, channel, value):
+        if value:
+            self.sleeping = False
+            self.booted_at = time.monotonic() + self.latency.boot
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        os.close(self.slave)
+        if self.thread:
+            self.thread.join()
+        os.close(self.master)
+
+    def host_baudrate(self):
+        '''
+        The baud rate the host side of the pseudo-terminal is set to.
+        '''
+        speed = termios.tcgetattr(self.slave)[5]
+        for name in dir(termios):
+            if name.startswith('B') and name[1:].isdigit():
+                if getattr(termios, name) == speed:
+                    return int(name[1:])
+        return None
+
+    def run(self):
+        while not self.stopped.is_set():
+            readable, _, _ = select.select([self.master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                b = os.read(self.master, 4096)
+            except OSError:
+                return
+            if not b:
+                return
+            self.bytes_received += len(b)
+            self.buffer.extend(b)
+            self._process()
+
+    ###########################################################################
+    # frame decoding
+
+    def _process(self):
+        header = Command.FRAME_HEADER[0]
+        while self.buffer:
+            if self.buffer[0] != header:
+                del self.buffer[0]
+                continue
+            if len(self.buffer) < 3:
+                return
+            length = struct.unpack('>H', self.buffer[1:3])[0]
+            if length < 9 or length > 1024:
+                del self.buffer[0]
+                continue
+            if len(self.buffer) < length:
+                return
+            packet = bytes(self.buffer[:length])
+            del self.buffer[:length]
+            self._packet(packet)
+
+    def _packet(self, packet):
+        if self.sleeping or time.monotonic() < self.booted_at:
+            return
+        self.commands += 1
+        self.wire_clock += self.latency.transfer(len(packet), self.baudrate)
+        start = max(self.wire_clock, self.modeled_time)
+
+        checksum = 0
+        for byte in packet[:-1]:
+            checksum ^= byte
+        if (checksum != packet[-1] or
+                not packet.endswith(Command.FRAME_FOOTER +
+                                    packet[-1:])):
+            self.checksum_errors += 1
+            self.modeled_time = start + self.latency.execute(0)
+            self._reply(self.ERROR_CHECKSUM, packet)
+            return
+
+        command = packet[3]
+        data = packet[4:-5]
+        self.command_counts[command] = self.command_counts.get(command, 0) + 1
+        handler = self.HANDLERS.get(command)
+        if handler is None:
+            self.modeled_time = start + self.latency.execute(0)
+            self._reply(self.ERROR_COMMAND, packet)
+            return
+        try:
+            response, pixels = handler(self, data)
+        except (struct.error, ValueError, IndexError):
+            response, pixels = self.ERROR_PARAMETER, 0
+        refresh = command == 0x0a
+        self.modeled_time = start + self.latency.execute(pixels, refresh)
+        if refresh:
+            # hosts wait for a refresh to finish before sending more
+            self.wire_clock = self.modeled_time
+        self._reply(response, packet)
+
+    def _reply(self, response, packet):
+        if self.realtime:
+            time.sleep(self.latency.transfer(len(packet), self.baudrate) +
+                       self.latency.execute(0))
+        if not response:
+            return
+        if self.host_baudrate() not in (None, self.baudrate):
+            # the two sides don't agree on the rate, the host gets garbage
+            response = bytes(len(response))
+        self.bytes_sent += len(response)
+        try:
+            os.write(self.master, response)
+        except OSError:
+            pass
+
+    ###########################################################################
+    # commands
+
+    def _ok(self):
+        return b'OK', 0
+
+    def _handshake(self, data):
+        return self._ok()
+
+    def _set_baudrate(self, data):
+        self.baudrate = struct.unpack('>L', data)[0]
+        return self._ok()
+
+    def _read_baudrate(self, data):
+        return str(self.baudrate).encode(), 0
+
+    def _read_storage_mode(self, data):
+        return str(self.storage_mode).encode(), 0
+
+    def _set_storage_mode(self, data):
+        self.storage_mode = data[0]
+        return self._ok()
+
+    def _sleep(self, data):
+        self.sleeping = True
+        return None, 0
+
+    def _import(self, data):
+        # importing from the TF card isn't answered
+        return None, 0
+
+    def _refresh(self, data):
+        self.refreshes += 1
+        self.screen.pixels[:] = self.framebuffer.pixels
+        if self.rotation:
+            self.screen.pixels.reverse()
+        return self._ok()
+
+    def _read_rotation(self, data):
+        return str(self.rotation).encode(), 0
+
+    def _set_rotation(self, data):
+        self.rotation = data[0]
+        return self._ok()
+
+    def _set_pallet(self, data):
+        self.foreground = data[0]
+        self.background = data[1]
+        return self._ok()
+
+    def _get_pallet(self, data):
+        return b'%d%d' % (self.foreground, self.background), 0
+
+    def _set_en_font_size(self, data):
+        self.en_font_size = data[0]
+        return self._ok()
+
+    def _set_zh_font_size(self, data):
+        self.zh_font_size = data[0]
+        return self._ok()
+
+    def _display_text(self, data):
+        x, y = struct.unpack('>HH', data[:4])
+        text = data[4:].split(b'\x00')[0]
+        height = 16 + (16 * self.en_font_size)
+        width = height // 2
+        pixels = 0
+        for i in range(len(text)):
+            left = x + (i * width)
+            pixels += self.framebuffer.fill_rectangle(
+                left, y, left + width - 2, y + height - 1, self.foreground)
+        return b'OK', pixels
+
+    def _display_image(self, data):
+        return self._ok()
+
+    def _shape(method, count):
+        def handler(self, data):
+            values = struct.unpack('>' + 'H' * count, data)
+            return b'OK', method(self.framebuffer, *values, self.foreground)
+        return handler
+
+    def _clear(self, data):
+        self.framebuffer.fill(self.background)
+        return b'OK', self.width * self.height
+
+    HANDLERS = {0x00: _handshake,
+                0x01: _set_baudrate,
+                0x02: _read_baudrate,
+                0x06: _read_storage_mode,
+                0x07: _set_storage_mode,
+                0x08: _sleep,
+                0x0a: _refresh,
+                0x0c: _read_rotation,
+                0x0d: _set_rotation,
+                0x0e: _import,
+                0x0f: _import,
+                0x10: _set_pallet,
+                0x11: _get_pallet,
+                0x1e: _set_en_font_size,
+                0x1f: _set_zh_font_size,
+                0x24: _shape(Framebuffer.fill_rectangle, 4),
+                0x25: _shape(Framebuffer.draw_rectangle, 4),
+                0x26: _shape(Framebuffer.draw_circle, 3),
+                0x27: _shape(Framebuffer.fill_circle, 3),
+                0x28: _shape(Framebuffer.draw_triangle, 6),
+                0x29: _shape(Framebuffer.fill_triangle, 6),
+                0x2e: _clear,
+                0x30: _display_text,
+                0x70: _display_image}
+    del _shape
@@ -0,0 +1,232 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import time
+import threading
+from collections import deque
+
+from waveshare.metrics import NULL_SINK
+
+###############################################################################
+# Serial transports
+###############################################################################
+
+# A transport is how EPaper gets bytes onto its serial port.  It is attached
+# to the port once it is open, and then given bytes with write(data, done),
+# which calls done() once they have been written.  drain() waits for
+# everything given to it to be out of the port, and close() drains and lets
+# go of it.
+
+# Bytes a WriteBehindTransport holds before writers have to wait, a bit
+# more than the largest invoice.
+DEFAULT_RING_SIZE = 32 * 1024
+
+
+class SerialTransport(object):
+    '''
+    Writes straight to the port on the caller's thread, which waits for the
+    write to go out.  This is what EPaper uses unless given another.
+    '''
+    def __init__(self):
+        self.serial = None
+
+    def attach(self, serial):
+        self.serial = serial
+        return self
+
+    def write(self, data, done=None):
+        self.serial.write(data)
+        if done:
+            done()
+
+    def drain(self, timeout=None):
+        self.serial.flush()
+        return True
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class WriteBehindTransport(object):
+    '''
+    Copies what is written into a ring buffer and returns straight away,
+    while a thread of its own writes it out to the port.  The thread that
+    draws can then go on encoding the next commands while the UART is still
+    busy with the last ones, rather than waiting in serial.write() for the
+    whole transfer:
+
+        paper = EPaper(transport=WriteBehindTransport())
+
+    Once the ring is full, write() waits for room, so a fast writer is held
+    to the pace of the port rather than using up memory.  drain() waits for
+    everything written so far to be out, which EPaper does after commands
+    such as RefreshAndUpdate so that a refresh really is on its way when
+    send() returns.
+
+    The bytes in the ring are reported as the transport.occupancy gauge,
+    the time write() spent waiting for room as the transport.stall timing
+    and the time drain() waited as transport.drain.  stats() has the same
+    and totals.
+    '''
+    def __init__(self, size=DEFAULT_RING_SIZE, metrics=None):
+        '''
+        @param size The number of bytes the ring buffer holds.
+        @param metrics The sink from waveshare.metrics to report to.
+        '''
+        self.ring = bytearray(size)
+        self.metrics = metrics or NULL_SINK
+        self.serial = None
+        self.condition = threading.Condition()
+        # where the next byte goes in, where the oldest byte comes out, and
+        # how many are waiting in between
+        self.head = 0
+        self.tail = 0
+        self.occupancy = 0
+        # bytes ever written to the ring and ever written out to the port,
+        # and the done() callbacks waiting on the latter to get to a count
+        self.accepted = 0
+        self.written = 0
+        self.callbacks = deque()
+        self.error = None
+        self.stopped = False
+        self.max_occupancy = 0
+        self.stalls = 0
+        self.stall_seconds = 0.0
+        self.drains = 0
+        self.drain_seconds = 0.0
+        self.thread = None
+
+    def attach(self, serial):
+        self.serial = serial
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def write(self, data, done=None):
+        '''
+        Copy data into the ring, waiting for room if it is full.  done() is
+        called on the writer thread once all of it is out.
+        '''
+        view = memoryview(data).cast('B')
+        size = len(self.ring)
+        with self.condition:
+            self._check()
+            while view:
+                free = size - self.occupancy
+                if free == 0:
+                    self._stall()
+                    continue
+                length = min(free, len(view), size - self.head)
+                self.ring[self.head:self.head + length] = view[:length]
+                view = view[length:]
+                self.head = (self.head + length) % size
+                self.occupancy += length
+                self.accepted += length
+                self.condition.notify_all()
+            if done:
+                self.callbacks.append((self.accepted, done))
+            self.max_occupancy = max(self.max_occupancy, self.occupancy)
+            occupancy = self.occupancy
+        if self.metrics.enabled:
+            self.metrics.gauge("transport.occupancy", occupancy)
+
+    def _stall(self):
+        # called with the condition held when the ring is full
+        start = time.monotonic()
+        self.condition.wait_for(
+            lambda: self.occupancy < len(self.ring) or self.error is not None)
+        self._check()
+        stalled = time.monotonic() - start
+        self.stalls += 1
+        self.stall_seconds += stalled
+        if self.metrics.enabled:
+            self.metrics.timing("transport.stall", stalled)
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+        if self.stopped:
+            raise ValueError("write to a closed transport")
+
+    def drain(self, timeout=None):
+        '''
+        Wait for everything written so far to be out of the port.  Returns
+        False if it isn't within timeout seconds.
+        '''
+        start = time.monotonic()
+        with self.condition:
+            target = self.accepted
+            drained = self.condition.wait_for(
+                lambda: self.written >= target or self.error is not None,
+                timeout)
+            if self.error is not None:
+                raise self.error
+        if drained:
+            # and out of the operating system's buffer too
+            self.serial.flush()
+        waited = time.monotonic() - start
+        with self.condition:
+            self.drains += 1
+            self.drain_seconds += waited
+        if self.metrics.enabled:
+            self.metrics.timing("transport.drain", waited)
+        return drained
+
+    def _run(self):
+        size = len(self.ring)
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.occupancy or self.stopped)
+                if not self.occupancy:
+                    return
+                # the bytes up to the end of the ring, the rest go next time
+                start = self.tail
+                length = min(self.occupancy, size - start)
+            try:
+                # the producers don't touch these bytes until they are let go
+                self.serial.write(memoryview(self.ring)[start:start + length])
+            except Exception as e:
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+            done = []
+            with self.condition:
+                self.tail = (self.tail + length) % size
+                self.occupancy -= length
+                self.written += length
+                while self.callbacks and self.callbacks[0][0] <= self.written:
+                    done.append(self.callbacks.popleft()[1])
+                self.condition.notify_all()
+            for callback in done:
+                callback()
+
+    def stats(self):
+        with self.condition:
+            return {'size':          len(self.ring),
+                    'occupancy':     self.occupancy,
+                    'max_occupancy': self.max_occupancy,
+                    'written':       self.written,
+                    'stalls':        self.stalls,
+                    'stall_seconds': self.stall_seconds,
+                    'drains':        self.drains,
+                    'drain_seconds': self.drain_seconds}
+
+    def close(self, timeout=None):
+        '''
+        Write out what is left and stop the thread.
+        '''
+        if self.thread is None:
+            return
+        if self.error is None:
+            self.drain(timeout)
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.thread = None
@@ -0,0 +1,325 @@
+# Copyright (c) 2019 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+from collections import deque
+from contextlib import contextmanager
+
+from twisted.internet import reactor as default_reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import DeferredList
+from twisted.internet.defer import gatherResults
+from twisted.internet.protocol import Protocol
+from twisted.internet.serialport import SerialPort
+
+from waveshare.gpio import BOARD
+from waveshare.gpio import RPiGPIOBackend
+from waveshare.metrics import NULL_SINK
+from waveshare.epaper import serial
+from waveshare.epaper import PORT_DEVICE
+from waveshare.epaper import PIN_RESET
+from waveshare.epaper import PIN_WAKEUP
+from waveshare.epaper import DEFAULT_BAUDRATE
+from waveshare.epaper import READY_POLL
+from waveshare.epaper import READY_POLL_MAX
+from waveshare.epaper import READY_TIMEOUT
+from waveshare.epaper import Handshake
+from waveshare.epaper import RefreshAndUpdate
+from waveshare.epaper import SleepMode
+from waveshare.responses import ResponseParser
+from waveshare.flowcontrol import FlowWindow
+
+###############################################################################
+# Twisted EPaper object
+###############################################################################
+
+# How long the device has to be quiet before a response that could still be
+# growing (an error code or a value) is taken as complete.
+READ_IDLE = 0.05
+
+
+class DeferredResponse(object):
+    '''
+    Lets a ResponseParser resolve a Deferred as if it were a future.
+    '''
+    def __init__(self):
+        self.deferred = Deferred()
+
+    def cancelled(self):
+        # a cancelled Deferred has already been errbacked
+        return self.deferred.called
+
+    def cancel(self):
+        self.deferred.cancel()
+
+    def set_result(self, result):
+        self.deferred.callback(result)
+
+    def set_exception(self, exception):
+        self.deferred.errback(exception)
+
+
+class TwistedEPaper(Protocol):
+    '''
+    The same as EPaper, but as a Twisted protocol on a SerialPort so the
+    display is driven from inside the reactor rather than from a thread.
+    Writes are never blocked on, commands that don't fit in the flow control
+    window are held back and written as responses come in, and every
+    command's response comes back through a Deferred.
+
+    The methods that wait in EPaper return Deferreds here instead, so
+    InvoiceDisplay can use it directly.
+    '''
+    def __init__(self, port=PORT_DEVICE, reset=PIN_RESET, wakeup=PIN_WAKEUP,
+                 mode=BOARD, window=None, reactor=default_reactor,
+                 gpio=None, metrics=None):
+        '''
+        @param port The file name to open.
+        @param reset The GPIO pin to use for resets.
+        @param wakeup The GPIO pin to use for wakeups.
+        @param mode The mode of GPIO pin addressing (GPIO.BOARD is the
+                    default).
+        @param window The FlowWindow limiting how many commands are sent ahead
+                      of their responses (a default one if None).
+        @param reactor The reactor to run in.
+        @param gpio The waveshare.gpio backend for the reset and wakeup pins,
+                    an RPiGPIOBackend in mode if None.
+        @param metrics The sink from waveshare.metrics to report the reset
+                       and wakeup pulses to (nothing is kept if None).
+        '''
+        self.metrics = metrics or NULL_SINK
+        self.gpio = gpio or RPiGPIOBackend(mode)
+        self.gpio.setup_outputs([reset, wakeup])
+
+        self.reset_pin = reset
+        self.wakeup_pin = wakeup
+        self.reactor = reactor
+
+        self.responses = ResponseParser()
+        self.window = window or FlowWindow()
+        self.responses.add_listener(self._response_received)
+
+        self.queue = deque()
+        self.frame_depth = 0
+        self.idle_call = None
+        self.stall_call = None
+
+        try:
+            self.serial = SerialPort(self, port, reactor,
+                                     baudrate=DEFAULT_BAUDRATE)
+        except Exception:
+            self.gpio.release([reset, wakeup])
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        '''
+        Closes the serial port and cleans up this object's GPIO pins.
+        '''
+        self.serial.loseConnection()
+        self.gpio.release([self.reset_pin, self.wakeup_pin])
+
+    ###########################################################################
+    # Protocol
+
+    def dataReceived(self, data):
+        self.responses.feed(data)
+        if self.idle_call and self.idle_call.active():
+            self.idle_call.reset(READ_IDLE)
+        else:
+            self.idle_call = self.reactor.callLater(READ_IDLE,
+                                                    self.responses.idle)
+        self._pump()
+
+    def connectionLost(self, reason):
+        for command, future, packet in self.queue:
+            future.set_exception(reason.value)
+        self.queue.clear()
+        self.responses.fail(reason.value)
+        for call in [self.idle_call, self.stall_call]:
+            if call and call.active():
+                call.cancel()
+
+    ###########################################################################
+    # EPaper API
+
+    def reset(self):
+        '''
+        Reset the display by setting the reset pin to high and then low.
+        '''
+        self._pulse(self.reset_pin, "epaper.reset_pulse")
+
+    def sleep(self):
+        '''
+        Tell the display to go to sleep.
+        '''
+        return self.send(SleepMode())
+
+    def wake(self):
+        '''
+        Tell the device to wake up.  It only makes sense to do this after
+        telling it to sleep.
+        '''
+        self._pulse(self.wakeup_pin, "epaper.wake_pulse")
+
+    def _pulse(self, pin, name):
+        seconds = self.gpio.pulse(pin)
+        if self.metrics.enabled:
+            self.metrics.timing(name, seconds)
+
+    def update(self):
+        '''
+        Update the display.
+        '''
+        return self.send(RefreshAndUpdate())
+
+    @contextmanager
+    def frame(self):
+        '''
+        Holds back every command sent inside the with clause so that they are
+        written to the serial port together when it exits.
+        '''
+        self.frame_depth += 1
+        try:
+            yield self
+        finally:
+            self.frame_depth -= 1
+            if self.frame_depth == 0:
+                self._pump()
+
+    def send(self, command):
+        '''
+        Queue the command to be written to the device.  Returns a Deferred
+        that fires with the response to this command, or fails with a
+        ResponseError if the device reports an error.
+        '''
+        return self._queue(command).deferred
+
+    def _queue(self, command):
+        future = DeferredResponse()
+        self.queue.append((command, future, command.encode()))
+        if self.frame_depth == 0:
+            self._pump()
+        return future
+
+    def wait_ready(self, timeout=READY_TIMEOUT, poll=READY_POLL,
+                   max_poll=READY_POLL_MAX):
+        '''
+        Poll the module with handshakes until it answers "OK", the same way
+        as EPaper.wait_ready(), but from reactor timers rather than by
+        blocking.  Returns a Deferred that fires with how many seconds it
+        took, or fails with serial.SerialTimeoutException if the module
+        hasn't answered within timeout seconds.
+        '''
+        start = self.reactor.seconds()
+        deadline = start + timeout
+        ready = Deferred()
+
+        def probe(poll):
+            future = self._queue(Handshake())
+            wait = max(0, min(poll, deadline - self.reactor.seconds()))
+            timer = self.reactor.callLater(wait, waited, future, poll)
+            def answered(result):
+                if result == ResponseParser.OK and not ready.called:
+                    timer.cancel()
+                    ready.callback(self.reactor.seconds() - start)
+            # an error answer waits out the poll, so as not to pester it
+            future.deferred.addCallbacks(answered, lambda failure: None)
+
+        def waited(future, poll):
+            if ready.called:
+                return
+            if not future.deferred.called:
+                # a module that isn't up yet ignores what it is sent, give
+                # up on the handshake alone so a late answer isn't taken
+                # for another command's
+                self.responses.abandon(future, serial.SerialTimeoutException(
+                    "no answer while waiting for the module to be ready"))
+            if self.reactor.seconds() >= deadline:
+                ready.errback(serial.SerialTimeoutException(
+                    "no handshake from the module within %0.1f seconds" %
+                    timeout))
+                return
+            probe(min(poll * 2, max_poll))
+
+        probe(poll)
+        return ready
+
+    def send_frame(self, commands):
+        '''
+        Send the commands together.  Returns a Deferred that fires with the
+        list of their responses once they have all come back.
+        '''
+        with self.frame():
+            deferreds = [self.send(command) for command in commands]
+        return gatherResults(deferreds, consumeErrors=True)
+
+    def cancel_queued(self):
+        '''
+        Drop the commands that haven't been written yet, such as the rest of
+        a draw that is no longer wanted.  Their Deferreds fail with
+        CancelledError.
+        '''
+        for command, future, packet in self.queue:
+            future.cancel()
+
+    def read_responses(self, timeout=3):
+        '''
+        Returns a Deferred that fires once every command sent so far has its
+        response, or after timeout seconds, whichever comes first.
+        '''
+        self._pump()
+        deferreds = ([future.deferred for future in self.responses.futures()]
+                     + [future.deferred for command, future, packet
+                        in self.queue])
+        d = Deferred()
+        def fire(result):
+            if not d.called:
+                d.callback(None)
+            return result
+        timer = self.reactor.callLater(timeout, fire, None)
+        done = DeferredList(deferreds, consumeErrors=True)
+        done.addCallback(fire)
+        done.addCallback(lambda _: timer.active() and timer.cancel())
+        return d
+
+    ###########################################################################
+    # flow control
+
+    def _pump(self, force=False):
+        '''
+        Write out as many queued commands as the flow control window allows.
+        '''
+        out = bytearray()
+        while self.queue:
+            command, future, packet = self.queue[0]
+            if (command.RESPONSE_BYTES and not force and
+                    self.responses.in_flight >= self.window.limit()):
+                break
+            force = False
+            self.queue.popleft()
+            if future.cancelled():
+                continue
+            self.responses.expect(command, future)
+            out.extend(packet)
+        if out:
+            self.transport.write(bytes(out))
+            self.responses.sent()
+        if self.stall_call and self.stall_call.active():
+            self.stall_call.cancel()
+        if self.queue and self.frame_depth == 0:
+            self.stall_call = self.reactor.callLater(self.window.timeout,
+                                                     self._stalled)
+
+    def _stalled(self):
+        # no response came back in time to open up the window
+        self.window.overrun()
+        self._pump(force=True)
+
+    def _response_received(self, command, kind, latency, in_flight):
+        if kind == 'error':
+            self.window.overrun()
+        elif latency is not None:
+            self.window.acked(latency, in_flight)